@@ -0,0 +1,55 @@
+-- Migration: Normalize existing tags to lowercase
+-- Tags are stored lowercased and trimmed on write; this brings older rows in line
+-- and merges case/whitespace duplicates. Readers still lower tags themselves, so
+-- running it is optional.
+-- Run with: docker exec -i zettl-postgres psql -U postgres -d zettl < migrations/lowercase_tags.sql
+
+\c zettl;
+
+BEGIN;
+
+DO $$
+DECLARE
+    owner_match TEXT := '';
+    removed INTEGER;
+    updated INTEGER;
+BEGIN
+    -- On multi-user schemas the same note id can exist once per user
+    IF EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_schema = 'public'
+        AND table_name = 'tags'
+        AND column_name = 'user_id'
+    ) THEN
+        owner_match := ' AND t.user_id = keep.user_id';
+    END IF;
+
+    -- Remove case/whitespace variants ("Todo", "todo ") that would collide with
+    -- UNIQUE(note_id, tag) once lowercased, keeping the oldest row of each group
+    EXECUTE '
+        DELETE FROM public.tags t
+        USING public.tags keep
+        WHERE t.note_id = keep.note_id' || owner_match || '
+        AND lower(btrim(t.tag)) = lower(btrim(keep.tag))
+        AND (COALESCE(keep.created_at, ''-infinity''), keep.id::text)
+          < (COALESCE(t.created_at, ''-infinity''), t.id::text)
+    ';
+    GET DIAGNOSTICS removed = ROW_COUNT;
+
+    UPDATE public.tags
+    SET tag = lower(btrim(tag))
+    WHERE tag <> lower(btrim(tag));
+    GET DIAGNOSTICS updated = ROW_COUNT;
+
+    RAISE NOTICE 'Removed % duplicate tag rows, lowercased % tag rows', removed, updated;
+END $$;
+
+COMMIT;
+
+-- Refresh the tag counts view if it exists so counts reflect the merged tags
+DO $$
+BEGIN
+    IF EXISTS (SELECT FROM pg_matviews WHERE matviewname = 'tag_counts') THEN
+        REFRESH MATERIALIZED VIEW tag_counts;
+    END IF;
+END $$;
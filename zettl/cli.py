@@ -1289,13 +1289,7 @@ def list(limit, full, compact):
         # Batch fetch all tags for these notes
         if note_ids:
             try:
-                all_tags = notes_manager.db.get_tags_for_notes(note_ids)
-                # Group tags by note_id
-                for tag_data in all_tags:
-                    note_id = tag_data['note_id']
-                    if note_id not in notes_tags:
-                        notes_tags[note_id] = []
-                    notes_tags[note_id].append(tag_data['tag'])
+                notes_tags = notes_manager.get_tags_bulk(note_ids)
             except Exception:
                 pass  # Fall back to no tags if batch fetch fails
 
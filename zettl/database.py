@@ -5,9 +5,9 @@ import time
 import requests
 import json
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 from zettl.config import POSTGREST_URL, AUTH_URL
-from functools import wraps
+from functools import wraps, lru_cache
 
 # Singleton client
 _http_session = None
@@ -16,6 +16,10 @@ _http_session = None
 _global_cache = {}
 _global_cache_ttl = {}
 _default_ttl = 300  # 5 minutes
+# Tag listings (todo, idea, note, ...) are also changed by the CLI, the MCP server
+# and other web workers, whose writes never clear this process's cache, so they
+# are only kept for a few seconds; local writes still drop them immediately
+_tag_query_ttl = 5
 
 def get_http_session():
     """Get or create the HTTP session singleton."""
@@ -51,6 +55,69 @@ def invalidate_cache(prefix=None):
         _global_cache.clear()
         _global_cache_ttl.clear()
 
+def invalidate_tag_queries():
+    """Invalidate the cached notes_by_tag and notes_with_all_tags_by_tag results."""
+    invalidate_cache("notes_by_tag:")
+    invalidate_cache("notes_with_all_tags_by_tag:")
+
+@lru_cache(maxsize=4096)
+def _format_timestamp(date_str: str) -> str:
+    """Format a timestamp for display (pure, so cached by its raw string)."""
+    # Handle None/null values
+    if date_str is None or date_str == 'null' or date_str == '':
+        import logging
+        logging.getLogger(__name__).warning("Received null/empty timestamp")
+        return "Unknown date"
+
+    try:
+        # PostgreSQL returns timestamps like: "2025-10-22 11:04:48.23+00"
+        # We need to handle: microseconds + timezone offset
+
+        # Extract timezone offset if present (+00, -05, +05:30, etc.)
+        timezone = ''
+        temp_str = date_str
+
+        # Check for timezone indicators
+        for tz_marker in ['+', '-']:
+            if tz_marker in temp_str.split('.')[-1] if '.' in temp_str else temp_str:
+                # Find the timezone part
+                parts = temp_str.rsplit(tz_marker, 1)
+                temp_str = parts[0]
+                timezone = tz_marker + parts[1]
+                break
+
+        # Check for 'Z' timezone
+        if temp_str.endswith('Z'):
+            timezone = 'Z'
+            temp_str = temp_str[:-1]
+
+        # Now handle microseconds
+        if '.' in temp_str:
+            main_part, microseconds = temp_str.split('.')
+            # Pad microseconds to 6 digits
+            microseconds = microseconds.ljust(6, '0')[:6]
+            temp_str = f"{main_part}.{microseconds}"
+
+        # Reconstruct with timezone
+        if timezone:
+            # Normalize timezone format for fromisoformat
+            if timezone == 'Z':
+                temp_str = temp_str + '+00:00'
+            elif ':' not in timezone and len(timezone) == 3:  # e.g., +00
+                temp_str = temp_str + timezone + ':00'
+            else:
+                temp_str = temp_str + timezone
+
+        # Parse and format
+        created_at = datetime.fromisoformat(temp_str).strftime('%Y-%m-%d %H:%M')
+        return created_at
+    except Exception as e:
+        # Fallback if date parsing fails - log the actual value for debugging
+        import logging
+        logging.getLogger(__name__).error(f"Failed to parse timestamp '{date_str}': {e}")
+        return "Unknown date"
+
+
 class Database:
     def __init__(self, jwt_token=None, api_key=None):
         self.session = get_http_session()
@@ -144,59 +211,7 @@ class Database:
 
     def format_timestamp(self, date_str: str) -> str:
         """Format a timestamp for display."""
-        # Handle None/null values
-        if date_str is None or date_str == 'null' or date_str == '':
-            import logging
-            logging.getLogger(__name__).warning("Received null/empty timestamp")
-            return "Unknown date"
-
-        try:
-            # PostgreSQL returns timestamps like: "2025-10-22 11:04:48.23+00"
-            # We need to handle: microseconds + timezone offset
-
-            # Extract timezone offset if present (+00, -05, +05:30, etc.)
-            timezone = ''
-            temp_str = date_str
-
-            # Check for timezone indicators
-            for tz_marker in ['+', '-']:
-                if tz_marker in temp_str.split('.')[-1] if '.' in temp_str else temp_str:
-                    # Find the timezone part
-                    parts = temp_str.rsplit(tz_marker, 1)
-                    temp_str = parts[0]
-                    timezone = tz_marker + parts[1]
-                    break
-
-            # Check for 'Z' timezone
-            if temp_str.endswith('Z'):
-                timezone = 'Z'
-                temp_str = temp_str[:-1]
-
-            # Now handle microseconds
-            if '.' in temp_str:
-                main_part, microseconds = temp_str.split('.')
-                # Pad microseconds to 6 digits
-                microseconds = microseconds.ljust(6, '0')[:6]
-                temp_str = f"{main_part}.{microseconds}"
-
-            # Reconstruct with timezone
-            if timezone:
-                # Normalize timezone format for fromisoformat
-                if timezone == 'Z':
-                    temp_str = temp_str + '+00:00'
-                elif ':' not in timezone and len(timezone) == 3:  # e.g., +00
-                    temp_str = temp_str + timezone + ':00'
-                else:
-                    temp_str = temp_str + timezone
-
-            # Parse and format
-            created_at = datetime.fromisoformat(temp_str).strftime('%Y-%m-%d %H:%M')
-            return created_at
-        except Exception as e:
-            # Fallback if date parsing fails - log the actual value for debugging
-            import logging
-            logging.getLogger(__name__).error(f"Failed to parse timestamp '{date_str}': {e}")
-            return "Unknown date"
+        return _format_timestamp(date_str)
 
     def generate_id(self) -> str:
         """Generate a Zettelkasten-style ID based on timestamp and random characters."""
@@ -345,6 +360,7 @@ class Database:
         # Invalidate relevant caches
         invalidate_cache(f"note:{note_id}")
         invalidate_cache("list_notes")
+        invalidate_tag_queries()
 
         return None
 
@@ -573,6 +589,7 @@ class Database:
             if e.response.status_code == 409:
                 # Tag was added between our check and insert, treat as success
                 invalidate_cache(f"tags:{note_id}")
+                invalidate_tag_queries()
                 return None
             raise Exception(f"Failed to add tag - Request failed: {str(e)}")
         except Exception as e:
@@ -584,6 +601,7 @@ class Database:
 
         # Invalidate related caches
         invalidate_cache(f"tags:{note_id}")
+        invalidate_tag_queries()
 
         return None
 
@@ -636,6 +654,7 @@ class Database:
 
         # Invalidate cache
         invalidate_cache(f"tags:{note_id}")
+        invalidate_tag_queries()
 
         return None
 
@@ -664,35 +683,36 @@ class Database:
 
         return tags
 
-    def get_tags_for_notes(self, note_ids: List[str]) -> List[Dict[str, Any]]:
-        """Get all tags for multiple notes in a single query."""
-        if not note_ids:
-            return []
+    def get_tags_bulk(self, note_ids: List[str]) -> Dict[str, List[str]]:
+        """Get tags for multiple notes as a {note_id: [tags]} map, fetching uncached notes in a single query."""
+        tags_map = {}
+        missing_ids = []
+        for note_id in note_ids:
+            cached_tags = get_from_cache(f"tags:{note_id}")
+            if cached_tags is not None:
+                tags_map[note_id] = cached_tags
+            else:
+                missing_ids.append(note_id)
+
+        if not missing_ids:
+            return tags_map
 
-        # Create IN clause for multiple note IDs
-        ids_str = ','.join(note_ids)
+        # Fetch tags for all uncached notes with a single IN query
+        missing_ids = list(dict.fromkeys(missing_ids))
+        ids_str = ','.join(missing_ids)
         params = {'note_id': f'in.({ids_str})', 'select': 'note_id,tag'}
+        response = self._make_request('GET', 'tags', params=params)
 
-        try:
-            response = self._make_request('GET', 'tags', params=params)
-            data = response.json() or []
-
-            # Also update individual caches
-            tags_by_note = {}
-            for tag_data in data:
-                note_id = tag_data['note_id']
-                if note_id not in tags_by_note:
-                    tags_by_note[note_id] = []
-                tags_by_note[note_id].append(tag_data['tag'])
-
-            # Cache individual note tags
-            for note_id in note_ids:
-                tags = tags_by_note.get(note_id, [])
-                set_in_cache(f"tags:{note_id}", tags, ttl=300)
+        for note_id in missing_ids:
+            tags_map[note_id] = []
+        for tag_data in response.json() or []:
+            tags_map.setdefault(tag_data['note_id'], []).append(tag_data['tag'])
 
-            return data
-        except Exception:
-            return []
+        # Cache individual note tags
+        for note_id in missing_ids:
+            set_in_cache(f"tags:{note_id}", tags_map[note_id], ttl=300)
+
+        return tags_map
 
     def search_notes(self, query: str) -> List[Dict[str, Any]]:
         """Search for notes containing the query string."""
@@ -767,7 +787,7 @@ class Database:
         tag_data = response.json()
         if not tag_data:
             # Cache empty result
-            set_in_cache(cache_key, [], ttl=300)
+            set_in_cache(cache_key, [], ttl=_tag_query_ttl)
             return []
 
         note_ids = [item['note_id'] for item in tag_data]
@@ -799,7 +819,7 @@ class Database:
                     continue
 
         # Cache the result
-        set_in_cache(cache_key, notes, ttl=300)
+        set_in_cache(cache_key, notes, ttl=_tag_query_ttl)
 
         return notes
 
@@ -834,7 +854,7 @@ class Database:
             }
             result.append(note)
 
-        set_in_cache(cache_key, result, ttl=300)
+        set_in_cache(cache_key, result, ttl=_tag_query_ttl)
         return result
 
     def get_all_tags_with_counts(self) -> List[Dict[str, Any]]:
@@ -934,7 +954,8 @@ class Database:
             # Return all project stats
             return data
 
-    def delete_note(self, note_id: str, cascade: bool = True, force: bool = False) -> None:
+    def delete_note(self, note_id: str, cascade: bool = True, force: bool = False,
+                    note: Optional[Dict[str, Any]] = None) -> None:
         """
         Delete a note from the database.
 
@@ -942,6 +963,7 @@ class Database:
             note_id: ID of the note to delete
             cascade: If True, also delete associated tags and links
             force: If True, skip existence checks and delete directly
+            note: Already-fetched note; if given, its existence isn't checked again
 
         Returns:
             None
@@ -950,8 +972,9 @@ class Database:
             Exception: If note deletion fails
         """
         if not force:
-            # Only verify the note exists if not forcing
-            self.get_note(note_id)
+            # Only verify the note exists if not forcing (and the caller hasn't already)
+            if note is None:
+                self.get_note(note_id)
 
             # If cascade is True, delete all associated data first
             if cascade:
@@ -998,6 +1021,7 @@ class Database:
         invalidate_cache(f"tags:{note_id}")
         invalidate_cache(f"related_notes:{note_id}")
         invalidate_cache("list_notes")
+        invalidate_tag_queries()
 
         return None
 
@@ -1017,6 +1041,7 @@ class Database:
 
         # Invalidate relevant caches
         invalidate_cache(f"tags:{note_id}")
+        invalidate_tag_queries()
 
         return None
 
@@ -1084,6 +1109,7 @@ class Database:
 
         # Invalidate relevant caches
         invalidate_cache(f"tags:{note_id}")
+        invalidate_tag_queries()
 
         return None
 
@@ -1111,8 +1137,8 @@ class Database:
 
         return None
 
-    def get_tags_created_today(self, tag: str) -> List[str]:
-        """Get note IDs for tags created today."""
+    def _get_tags_created_today(self, tag: str, select: str) -> List[Dict[str, Any]]:
+        """Get rows of a tag created today, limited to the selected columns."""
         from datetime import datetime, timezone
 
         # Get today's date range
@@ -1126,7 +1152,7 @@ class Database:
 
         # Build URL manually to support multiple filters on same field
         url = f"{self.postgrest_url}/tags"
-        query_params = f"tag=eq.{tag.lower().strip()}&created_at=gte.{start_timestamp}&created_at=lte.{end_timestamp}&select=note_id,created_at"
+        query_params = f"tag=eq.{tag.lower().strip()}&created_at=gte.{start_timestamp}&created_at=lte.{end_timestamp}&select={select}"
         full_url = f"{url}?{query_params}"
 
         # Add authorization headers
@@ -1144,6 +1170,17 @@ class Database:
         except Exception:
             return []
 
+    def get_tags_created_today(self, tag: str) -> List[Dict[str, Any]]:
+        """Get note IDs for tags created today."""
+        return self._get_tags_created_today(tag, 'note_id,created_at')
+
+    def iter_note_ids_with_tag_today(self, tag: str) -> Iterator[str]:
+        """Yield the IDs of notes that were given a tag today."""
+        for row in self._get_tags_created_today(tag, 'note_id'):
+            note_id = row.get('note_id')
+            if note_id:
+                yield note_id
+
     def merge_notes(self, note_ids: List[str]) -> str:
         """
         Merge multiple notes into a single note.
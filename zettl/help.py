@@ -1,6 +1,34 @@
 # help.py
 import re
 
+# Matches one rich markup span; the open and close tags are checked against
+# each other in _markup_to_markdown so every span is converted in one pass.
+_MARKUP_RE = re.compile(
+    r'\[(bold [^\]]+|bold|blue|cyan|yellow)\]([^\[]+)\[/(bold [^\]]+|bold|blue|cyan|yellow)\]'
+)
+
+# Markdown delimiter for each markup style ('bold *' covers bold with a color)
+_MARKUP_TO_MARKDOWN = {
+    'bold *': '**',
+    'bold': '**',
+    'blue': '*',
+    'cyan': '`',
+    'yellow': '',
+}
+
+
+def _markup_style(tag):
+    return 'bold *' if tag.startswith('bold ') else tag
+
+
+def _markup_to_markdown(match):
+    style = _markup_style(match.group(1))
+    if style != _markup_style(match.group(3)):
+        return match.group(0)
+    delim = _MARKUP_TO_MARKDOWN[style]
+    return f"{delim}{match.group(2)}{delim}"
+
+
 class CommandHelp:
     """Centralized help system for Zettl commands."""
 
@@ -16,24 +44,12 @@ class CommandHelp:
     def _convert_to_markdown(cls, text):
         """Convert rich markup to markdown."""
         # [bold green]text[/bold green] -> **text**
-        # [bold]text[/bold green] -> **text**
+        # [bold yellow]text[/bold yellow] -> **text**
+        # [bold]text[/bold] -> **text**
         # [blue]text[/blue] -> *text* (use italic for colored text)
         # [cyan]text[/cyan] -> `text` (use code for cyan)
-        # [bold yellow]text[/bold yellow] -> **text**
-
-        # Replace bold with color markers -> just bold
-        text = re.sub(r'\[bold [^\]]+\]([^\[]+)\[/bold [^\]]+\]', r'**\1**', text)
-        # Replace plain bold
-        text = re.sub(r'\[bold\]([^\[]+)\[/bold\]', r'**\1**', text)
-        # Replace colored text with italics
-        text = re.sub(r'\[blue\]([^\[]+)\[/blue\]', r'*\1*', text)
-        # Replace cyan with inline code
-        text = re.sub(r'\[cyan\]([^\[]+)\[/cyan\]', r'`\1`', text)
-        # Replace yellow (keep plain for markdown)
-        text = re.sub(r'\[yellow\]([^\[]+)\[/yellow\]', r'\1', text)
-        text = re.sub(r'\[bold yellow\]([^\[]+)\[/bold yellow\]', r'**\1**', text)
-
-        return text
+        # [yellow]text[/yellow] -> text (keep plain for markdown)
+        return _MARKUP_RE.sub(_markup_to_markdown, text)
 
     @classmethod
     def get_main_help(cls):
@@ -187,18 +187,20 @@ class LLMHelper:
             
             raise Exception(f"API request failed: {error_msg}")
         
-    def summarize_note(self, note_id: str) -> str:
+    def summarize_note(self, note_id: str, note: Optional[Dict[str, Any]] = None) -> str:
         """
         Summarize a single note's content focusing on its key ideas.
 
         Args:
             note_id: ID of the note to summarize
+            note: Already-fetched note, to avoid looking it up again
 
         Returns:
             A concise summary of the note's ideas
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
 
             system_message = """You are skilled at distilling complex ideas.
     Your task is to provide a clear, concise summary that captures the essence of the text.
@@ -217,19 +219,21 @@ class LLMHelper:
         except Exception as e:
             return f"Error summarizing note: {str(e)}"
         
-    def generate_connections(self, note_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+    def generate_connections(self, note_id: str, limit: int = 5, note: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         Find potential connections between this note's ideas and others in the system.
         
         Args:
             note_id: ID of the note to find connections for
             limit: Maximum number of connections to return
+            note: Already-fetched note, to avoid looking it up again
             
         Returns:
             List of dictionaries containing note_id and explanation of the conceptual connection
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
             
             # Get tags for the source note
             source_tags = self.db.get_tags(note_id)
@@ -358,19 +362,21 @@ class LLMHelper:
             print(f"Error generating connections: {str(e)}")
             return []
             
-    def suggest_tags(self, note_id: str, count: int = 3) -> List[str]:
+    def suggest_tags(self, note_id: str, count: int = 3, note: Optional[Dict[str, Any]] = None) -> List[str]:
         """
         Suggest tags based on the key themes and concepts in a note.
         
         Args:
             note_id: ID of the note to suggest tags for
             count: Number of tags to suggest
+            note: Already-fetched note, to avoid looking it up again
             
         Returns:
             List of suggested tags
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
             
             system_message = """You are skilled at identifying key themes and concepts.
     Your task is to suggest relevant, precise tags that capture the main topics and concepts in this text.
@@ -464,19 +470,21 @@ class LLMHelper:
             print(f"Error suggesting tags: {str(e)}")
             return []
         
-    def extract_key_concepts(self, note_id: str, count: int = 5) -> List[Dict[str, str]]:
+    def extract_key_concepts(self, note_id: str, count: int = 5, note: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
         """
         Extract key concepts from a note with explanations.
         
         Args:
             note_id: ID of the note to extract concepts from
             count: Number of concepts to extract
+            note: Already-fetched note, to avoid looking it up again
             
         Returns:
             List of dictionaries with concept and explanation keys
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
             
             system_message = """You are skilled at identifying and explaining key concepts.
     Your task is to identify the most important concepts in this text and provide a clear explanation for each.
@@ -619,19 +627,21 @@ class LLMHelper:
             print(f"Error extracting concepts: {str(e)}")
             return []
         
-    def generate_question_note(self, note_id: str, count: int = 3) -> List[Dict[str, str]]:
+    def generate_question_note(self, note_id: str, count: int = 3, note: Optional[Dict[str, Any]] = None) -> List[Dict[str, str]]:
         """
         Generate thought-provoking questions based on a note's content.
         
         Args:
             note_id: ID of the note to generate questions from
             count: Number of questions to generate
+            note: Already-fetched note, to avoid looking it up again
             
         Returns:
             List of dictionaries with question and explanation keys
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
             
             system_message = """You are skilled at generating insightful questions.
     Your task is to generate thought-provoking questions that explore and extend the ideas in the text.
@@ -771,18 +781,20 @@ class LLMHelper:
             print(f"Error generating questions: {str(e)}")
             return []
             
-    def expand_note(self, note_id: str) -> str:
+    def expand_note(self, note_id: str, note: Optional[Dict[str, Any]] = None) -> str:
         """
         Expand the ideas in a note with additional details and insights.
 
         Args:
             note_id: ID of the note to expand
+            note: Already-fetched note, to avoid looking it up again
 
         Returns:
             Expanded version of the ideas in the note
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
 
             system_message = """You are an expert at developing and enriching ideas.
     Your task is to thoughtfully expand on the concepts presented with additional context, examples, and insights.
@@ -810,18 +822,20 @@ class LLMHelper:
         except Exception as e:
             return f"Error expanding note: {str(e)}"
         
-    def critique_note(self, note_id: str) -> Dict[str, Any]:
+    def critique_note(self, note_id: str, note: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Provide constructive critique on the ideas in a note.
 
         Args:
             note_id: ID of the note to critique
+            note: Already-fetched note, to avoid looking it up again
 
         Returns:
             Dictionary with strengths, weaknesses, and suggestions
         """
         try:
-            note = self.db.get_note(note_id)
+            if note is None:
+                note = self.db.get_note(note_id)
 
             system_message = """You are a thoughtful critic.
     Your task is to provide constructive critique of the ideas presented in this text.
@@ -1,5 +1,5 @@
 # notes.py
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from zettl.database import Database
 
 class Notes:
@@ -48,6 +48,10 @@ class Notes:
         """Get all tags for a note."""
         return self.db.get_tags(note_id)
         
+    def get_tags_bulk(self, note_ids: List[str]) -> Dict[str, List[str]]:
+        """Get tags for multiple notes in a single request, keyed by note ID."""
+        return self.db.get_tags_bulk(note_ids)
+        
     def search_notes(self, query: str) -> List[Dict[str, Any]]:
         """Search for notes containing the query string."""
         return self.db.search_notes(query)
@@ -76,9 +80,10 @@ class Notes:
         """Get note IDs for tags created today."""
         return self.db.get_tags_created_today(tag)
 
-    def delete_note(self, note_id: str, cascade: bool = True, force: bool = False) -> None:
+    def delete_note(self, note_id: str, cascade: bool = True, force: bool = False,
+                    note: Optional[Dict[str, Any]] = None) -> None:
         """Delete a note and optionally its associated tags and links."""
-        return self.db.delete_note(note_id, cascade, force)
+        return self.db.delete_note(note_id, cascade, force, note=note)
         
     def delete_note_tags(self, note_id: str) -> None:
         """Delete all tags associated with a note."""
@@ -1,32 +1,35 @@
 # File: zettl_web.py
 
 import os
+import io
 import json
 import logging
 import shlex
 import sys
+import threading
+import time
+import hashlib
 import requests
 from flask import Flask, request, jsonify, render_template, Response, session, redirect, url_for
-from functools import wraps
+from functools import wraps, lru_cache
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import BadRequest
 from dotenv import load_dotenv
 import re
-import jwt
 from datetime import datetime, timezone
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Add the parent directory to the Python path to find the zettl module
 sys.path.insert(0, '/app')
 
 from zettl.help import CommandHelp
 
-# Load environment variables from parent directory
-script_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(script_dir)
-dotenv_path = os.path.join(parent_dir, '.env')
-print(f"Looking for .env file at: {dotenv_path}")
-print(f"File exists: {os.path.exists(dotenv_path)}")
-load_dotenv(dotenv_path)
-
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -34,6 +37,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Load environment variables from parent directory (no-op if the file is missing)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+dotenv_path = os.path.join(parent_dir, '.env')
+logger.debug("Loading .env file from: %s", dotenv_path)
+load_dotenv(dotenv_path, override=False)
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -57,13 +67,13 @@ if JWT_SECRET_FILE and os.path.exists(JWT_SECRET_FILE):
 else:
     JWT_SECRET = os.getenv('JWT_SECRET')
 
-print(f"Auth service URL: {AUTH_URL}")
-print(f"JWT secret configured: {'Yes' if JWT_SECRET else 'No'}")
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("Auth service URL: %s", AUTH_URL)
+    logger.debug("JWT secret configured: %s", 'Yes' if JWT_SECRET else 'No')
 
 # Import Zettl components
 from zettl.notes import Notes
 from zettl.database import Database
-from zettl.llm import LLMHelper
 from zettl.formatting import ZettlFormatter
 from zettl.help import CommandHelp
 
@@ -71,12 +81,59 @@ from zettl.help import CommandHelp
 ZettlFormatter.set_mode('web')
 CommandHelp.set_mode('web')
 
+# The formatter mode is fixed for the process, so tokens that recur within and
+# across requests (tags, note IDs, timestamps) only need formatting once
+_fmt_tag = lru_cache(maxsize=1024)(ZettlFormatter.tag)
+_fmt_note_id = lru_cache(maxsize=1024)(ZettlFormatter.note_id)
+_fmt_timestamp = lru_cache(maxsize=1024)(ZettlFormatter.timestamp)
+
 logger.debug("Successfully imported Zettl components")
 
+# Negative cache for tokens the auth service rejected, keyed by token hash
+# so no secret material is retained. Bounded LRU with a short TTL, shared
+# across request threads and guarded by _bad_token_cache_lock.
+_bad_token_cache = OrderedDict()
+_bad_token_cache_lock = threading.Lock()
+_BAD_TOKEN_CACHE_MAXSIZE = 4096
+_BAD_TOKEN_CACHE_TTL = 30  # seconds
+
+def _token_hash(token):
+    """Hash a token for use as a cache key."""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def _is_known_bad_token(token_hash):
+    """Check whether a token was recently rejected by the auth service."""
+    with _bad_token_cache_lock:
+        expires_at = _bad_token_cache.get(token_hash)
+        if expires_at is None:
+            return False
+        if time.time() >= expires_at:
+            _bad_token_cache.pop(token_hash, None)
+            return False
+        return True
+
+def _remember_bad_token(token_hash):
+    """Record a rejected token, evicting the oldest entries when full."""
+    with _bad_token_cache_lock:
+        _bad_token_cache[token_hash] = time.time() + _BAD_TOKEN_CACHE_TTL
+        _bad_token_cache.move_to_end(token_hash)
+        while len(_bad_token_cache) > _BAD_TOKEN_CACHE_MAXSIZE:
+            _bad_token_cache.popitem(last=False)
+
+_login_page_url = None
+
+def _login_redirect():
+    """Redirect to the login page, resolving its URL once since the route is static."""
+    global _login_page_url
+    if _login_page_url is None:
+        _login_page_url = url_for('login_page')
+    return redirect(_login_page_url)
+
 # JWT token validation decorator
 def jwt_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        is_api = request.path.startswith('/api/')
         token = None
 
         # Check for token in session first
@@ -89,10 +146,19 @@ def jwt_required(f):
                 token = auth_header.split(' ')[1]
 
         if not token:
-            if request.path.startswith('/api/'):
+            if is_api:
                 return jsonify({'error': 'No token provided'}), 401
             else:
-                return redirect(url_for('login_page'))
+                return _login_redirect()
+
+        # Reject recently invalidated tokens without hitting the auth service
+        token_hash = _token_hash(token)
+        if _is_known_bad_token(token_hash):
+            session.clear()
+            if is_api:
+                return jsonify({'error': 'Invalid or expired token'}), 401
+            else:
+                return _login_redirect()
 
         try:
             # Validate token with auth service
@@ -106,16 +172,20 @@ def jwt_required(f):
                     request.current_user = data.get('user')
                     return f(*args, **kwargs)
 
+            # Only cache definitive rejections, not auth service errors
+            if response.status_code < 500:
+                _remember_bad_token(token_hash)
+
             # Token invalid - clear session and redirect
             session.clear()
-            if request.path.startswith('/api/'):
+            if is_api:
                 return jsonify({'error': 'Invalid or expired token'}), 401
             else:
-                return redirect(url_for('login_page'))
+                return _login_redirect()
 
         except requests.RequestException as e:
             logger.error(f"Auth service connection error: {e}")
-            if request.path.startswith('/api/'):
+            if is_api:
                 return jsonify({'error': 'Authentication service unavailable'}), 503
             else:
                 return render_template('login.html', error='Authentication service unavailable')
@@ -153,6 +223,9 @@ def get_llm_helper():
     except Exception as e:
         logger.error(f"Could not fetch Claude API key: {e}")
 
+    # Imported here so requests that never touch the LLM don't pay for it
+    from zettl.llm import LLMHelper
+
     # Create LLMHelper instance
     llm_helper = LLMHelper(jwt_token=jwt_token)
 
@@ -255,6 +328,24 @@ COMMAND_OPTIONS = {
             'list': {'flag': True}
         }
     },
+    'link': {
+        'short_opts': {
+            'c': {'name': 'context'},
+            'r': {'name': 'remove', 'flag': True}
+        },
+        'long_opts': {
+            'context': {},
+            'remove': {'flag': True}
+        }
+    },
+    'graph': {
+        'short_opts': {
+            'o': {'name': 'output'}
+        },
+        'long_opts': {
+            'output': {}
+        }
+    },
     'merge': {
         'short_opts': {
             'f': {'name': 'force', 'flag': True}
@@ -335,146 +426,198 @@ COMMAND_OPTIONS = {
 }
 
 
+def _compile_option_specs(cmd_config):
+    """
+    Flatten a COMMAND_OPTIONS entry into lookup tables of
+    (name, is_flag, value_type, is_multiple) tuples keyed by the option token,
+    plus whether the command takes any options at all.
+    """
+    long_specs = {}
+    for opt_name, opt_config in cmd_config['long_opts'].items():
+        long_specs[opt_name] = (opt_name, opt_config.get('flag', False),
+                                opt_config.get('type'), opt_config.get('multiple', False))
+
+    short_specs = {}
+    for opt_char, opt_config in cmd_config['short_opts'].items():
+        short_specs[opt_char] = (opt_config.get('name', opt_char), opt_config.get('flag', False),
+                                 opt_config.get('type'), opt_config.get('multiple', False))
+
+    return long_specs, short_specs, bool(long_specs or short_specs)
+
+
+# Option lookup tables compiled once at import instead of on every request
+_COMPILED_OPTS = {cmd: _compile_option_specs(cfg) for cmd, cfg in COMMAND_OPTIONS.items()}
+# Commands without a COMMAND_OPTIONS entry still go through the generic parser
+_EMPTY_OPTS = ({}, {}, True)
+_UNKNOWN_LONG_OPT = (None, False, None, False)
+
+
+def _first_arg(args, default=""):
+    """Return the first positional argument, or a default when there is none."""
+    return args[0] if args else default
+
+
+@lru_cache(maxsize=256)
+def _highlight_re(query):
+    """Compile (once per query) the case-insensitive pattern used to highlight search matches."""
+    return re.compile(re.escape(query), re.IGNORECASE)
+
+
+# Rule printed under each note header in full-content listings
+_SEP = "-" * 40 + "\n"
+
+
+@lru_cache(maxsize=2048)
+def _preview(text, length=50):
+    """Truncate text to a preview of the given length, adding an ellipsis if it was cut."""
+    return text if len(text) <= length else text[:length] + "..."
+
+
+# Matches the start of each numbered rule line in a note, like "1. Rule" or "2) Rule".
+# [^\S\n] is whitespace other than newline, so a match never spans lines.
+_RULE_START_RE = re.compile(r'(?m)^[^\S\n]*\d+[\.\)][^\S\n]+')
+
+
+# Small pool for overlapping per-note tag requests when the bulk query fails
+_tag_pool = ThreadPoolExecutor(max_workers=8)
+
+
+def _safe_get_tags(notes_manager, note_id):
+    """Get tags for a single note, treating failures as no tags."""
+    try:
+        return notes_manager.get_tags(note_id)
+    except Exception:
+        return []
+
+
+def _prefetch_tags(notes_manager, note_ids):
+    """
+    Get a {note_id: [tags]} map for the given notes. Uses the single bulk query
+    and falls back to fetching each note's tags concurrently if that fails.
+    """
+    try:
+        return notes_manager.get_tags_bulk(note_ids)
+    except Exception as e:
+        logger.debug("Bulk tag fetch failed, fetching per note: %s", e)
+
+    futures = {note_id: _tag_pool.submit(_safe_get_tags, notes_manager, note_id)
+               for note_id in dict.fromkeys(note_ids)}
+    return {note_id: future.result() for note_id, future in futures.items()}
+
+
 def extract_options(args, cmd):
     """
     Extract options and flags from arguments based on command configuration
     Returns options dict, flags list, and remaining args
     """
+    # Get compiled command configuration or empty tables if command not found
+    long_specs, short_specs, has_opts = _COMPILED_OPTS.get(cmd, _EMPTY_OPTS)
+
+    # Commands configured without options take every argument as positional
+    if not has_opts:
+        return {}, [], list(args)
+
     options = {}
     flags = []
     remaining_args = []
-    
-    # Get command configuration or empty dict if command not found
-    cmd_config = COMMAND_OPTIONS.get(cmd, {'short_opts': {}, 'long_opts': {}})
-    short_opts = cmd_config['short_opts']
-    long_opts = cmd_config['long_opts']
-    
+
+    n = len(args)
     i = 0
-    while i < len(args):
+    while i < n:
         arg = args[i]
-        
+
         if arg == '-dt':
             flags.append('dt')
             options['donetoday'] = True
             i += 1
-        # Handle long options (--option)
-        elif arg.startswith('--'):
-            opt_name = arg[2:]
-            opt_config = long_opts.get(opt_name, {})
-            
-            # If it's a flag option
-            if opt_config.get('flag', False):
-                flags.append(opt_name)
-                options[opt_name] = True
-                i += 1
-            # If it takes a value
-            elif i + 1 < len(args) and not args[i+1].startswith('-'):
-                value = args[i+1]
-                
-                # Convert type if specified
-                if 'type' in opt_config:
-                    try:
-                        value = opt_config['type'](value)
-                    except ValueError:
-                        pass
-                
-                # Handle multiple values
-                if opt_config.get('multiple', False):
-                    if opt_name not in options:
-                        options[opt_name] = []
-                    options[opt_name].append(value)
-                else:
-                    options[opt_name] = value
-                i += 2
-            else:
-                # Treat as flag if no value provided
-                flags.append(opt_name)
-                options[opt_name] = True
-                i += 1
-                
-        # Handle short options (-o)
+            continue
+
+        # Handle long options (--option) and short options (-o)
+        if arg.startswith('--'):
+            opt_key = arg[2:]
+            opt_name, is_flag, value_type, is_multiple = long_specs.get(opt_key, _UNKNOWN_LONG_OPT)
+            opt_name = opt_name or opt_key
         elif arg.startswith('-') and len(arg) == 2:
-            opt_char = arg[1]
-            if opt_char in short_opts:
-                opt_config = short_opts[opt_char]
-                opt_name = opt_config.get('name', opt_char)
-                
-                # If it's a flag option
-                if opt_config.get('flag', False):
-                    flags.append(opt_char)
-                    options[opt_name] = True
-                    i += 1
-                # If it takes a value
-                elif i + 1 < len(args) and not args[i+1].startswith('-'):
-                    value = args[i+1]
-                    
-                    # Convert type if specified
-                    if 'type' in opt_config:
-                        try:
-                            value = opt_config['type'](value)
-                        except ValueError:
-                            pass
-                    
-                    # Handle multiple values
-                    if opt_config.get('multiple', False):
-                        if opt_name not in options:
-                            options[opt_name] = []
-                        options[opt_name].append(value)
-                    else:
-                        options[opt_name] = value
-                    i += 2
-                else:
-                    # Treat as flag if no value provided
-                    flags.append(opt_char)
-                    options[opt_name] = True
-                    i += 1
-            else:
+            opt_key = arg[1]
+            spec = short_specs.get(opt_key)
+            if spec is None:
                 # Unknown short option, treat as flag
-                flags.append(opt_char)
+                flags.append(opt_key)
                 i += 1
-                
+                continue
+            opt_name, is_flag, value_type, is_multiple = spec
         # Handle combined short options (-abc)
         elif arg.startswith('-') and len(arg) > 2:
-            combined_flags = arg[1:]
-            for flag in combined_flags:
+            for flag in arg[1:]:
                 flags.append(flag)
-                # Map to long option name if exists
-                if flag in short_opts:
-                    opt_name = short_opts[flag].get('name', flag)
-                    options[opt_name] = True
-                else:
-                    # Even if not in short_opts config, keep the flag
-                    options[flag] = True
+                # Only store known options, under their canonical long name;
+                # unknown ones are still available through flags
+                spec = short_specs.get(flag)
+                if spec is not None:
+                    options[spec[0]] = True
             i += 1
+            continue
         elif arg.startswith('+t'):
-            if i + 1 < len(args) and not args[i+1].startswith('-'):
-                # Handle multiple exclude tags
-                if 'exclude-tag' not in options:
-                    options['exclude-tag'] = []
-                options['exclude-tag'].append(args[i+1])
+            # Handle multiple exclude tags; +t without value is treated as a flag
+            if i + 1 < n and not args[i+1].startswith('-'):
+                options.setdefault('exclude-tag', []).append(args[i+1])
                 i += 2
             else:
-                # If +t without value, treat as flag
-                if 'exclude-tag' not in options:
-                    options['exclude-tag'] = []
-                options['exclude-tag'].append(True)
+                options.setdefault('exclude-tag', []).append(True)
                 i += 1
+            continue
         else:
-            # Add this else clause to capture non-option arguments
+            # Capture non-option arguments
             remaining_args.append(arg)
             i += 1
-            
+            continue
+
+        # If it's a flag option
+        if is_flag:
+            flags.append(opt_key)
+            options[opt_name] = True
+            i += 1
+        # If it takes a value
+        elif i + 1 < n and not args[i+1].startswith('-'):
+            value = args[i+1]
+
+            # Convert type if specified
+            if value_type is not None:
+                try:
+                    value = value_type(value)
+                except ValueError:
+                    pass
+
+            # Handle multiple values
+            if is_multiple:
+                options.setdefault(opt_name, []).append(value)
+            else:
+                options[opt_name] = value
+            i += 2
+        else:
+            # Treat as flag if no value provided
+            flags.append(opt_key)
+            options[opt_name] = True
+            i += 1
+
     return options, flags, remaining_args
 
 # Simplified HTML processing for markdown content
+def _contains_raw_html(text):
+    """Check whether text already contains HTML layout tags (like from Eisenhower matrix)."""
+    # Most results are plain markdown, so a single scan for '<' settles them
+    if '<' not in text:
+        return False
+    return '<div' in text or '<table' in text or '<span' in text
+
 def process_for_web(text):
     """
     Process text for web display - everything is treated as markdown unless it's already HTML.
     No ANSI codes, no special markers needed.
     """
-    # If the text already contains HTML tags (like from Eisenhower matrix), don't wrap it in markdown-content
+    # If the text already contains HTML tags, don't wrap it in markdown-content
     # This allows raw HTML to pass through for complex layouts like tables
-    if '<div' in text or '<table' in text or '<span' in text:
+    if _contains_raw_html(text):
         return text
 
     # Otherwise, wrap in markdown-content div for markdown rendering
@@ -485,24 +628,43 @@ def format_note_content_for_web(note, notes_manager):
     note_id = note['id']
     created_at = notes_manager.db.format_timestamp(note['created_at'])
 
-    formatted_id = ZettlFormatter.note_id(note_id)
-    formatted_time = ZettlFormatter.timestamp(created_at)
+    formatted_id = _fmt_note_id(note_id)
+    formatted_time = _fmt_timestamp(created_at)
 
     header_line = f"{formatted_id} [{formatted_time}]"
-    separator = "-" * 40
 
     # Return formatted parts - everything is markdown now
     return {
         'header': header_line,
-        'separator': separator,
+        'separator': _SEP.rstrip('\n'),
         'content': note['content'],
         'is_markdown': True
     }
 
+@lru_cache(maxsize=64)
+def _render_help(cmd):
+    """Render the web help text for a command (deterministic, so cached per command)."""
+    return process_for_web(CommandHelp.get_command_help(cmd))
+
 def show_command_help(cmd):
     """Show detailed help for a specific command."""
-    help_text = CommandHelp.get_command_help(cmd)
-    return jsonify({'result': process_for_web(help_text)})
+    return _json_resp({'result': _render_help(cmd)})
+
+
+def _json_body():
+    """Decode the JSON request body, using orjson when available."""
+    if orjson is None:
+        return request.get_json()
+    try:
+        return orjson.loads(request.get_data() or b'{}')
+    except orjson.JSONDecodeError:
+        raise BadRequest('Failed to decode JSON object')
+
+def _json_resp(obj, status=200):
+    """Build a JSON response, using orjson when available."""
+    if orjson is None:
+        return jsonify(obj), status
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
 
 
 # Routes
@@ -528,12 +690,12 @@ def health_check():
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    data = request.get_json()
+    data = _json_body()
     username = data.get('username')
     password = data.get('password')
 
     if not username or not password:
-        return jsonify({'error': 'Username and password required', 'success': False}), 400
+        return _json_resp({'error': 'Username and password required', 'success': False}, 400)
 
     try:
         # Authenticate with auth service
@@ -548,34 +710,34 @@ def login():
             session['refresh_token'] = data['refreshToken']
             session['user'] = data['user']
 
-            return jsonify({
+            return _json_resp({
                 'success': True,
                 'message': 'Login successful',
                 'user': data['user']
             })
         else:
             error_data = response.json() if response.content else {}
-            return jsonify({
+            return _json_resp({
                 'error': error_data.get('error', 'Login failed'),
                 'success': False
-            }), response.status_code
+            }, response.status_code)
 
     except requests.RequestException as e:
         logger.error(f"Auth service connection error: {e}")
-        return jsonify({
+        return _json_resp({
             'error': 'Authentication service unavailable',
             'success': False
-        }), 503
+        }, 503)
 
 @app.route('/api/register', methods=['POST'])
 def register():
-    data = request.get_json()
+    data = _json_body()
     username = data.get('username')
     email = data.get('email')
     password = data.get('password')
 
     if not username or not email or not password:
-        return jsonify({'error': 'Username, email and password required', 'success': False}), 400
+        return _json_resp({'error': 'Username, email and password required', 'success': False}, 400)
 
     try:
         # Register with auth service
@@ -584,23 +746,23 @@ def register():
                                timeout=10)
 
         if response.status_code == 201:
-            return jsonify({
+            return _json_resp({
                 'success': True,
                 'message': 'Registration successful'
             })
         else:
             error_data = response.json() if response.content else {}
-            return jsonify({
+            return _json_resp({
                 'error': error_data.get('error', 'Registration failed'),
                 'success': False
-            }), response.status_code
+            }, response.status_code)
 
     except requests.RequestException as e:
         logger.error(f"Auth service connection error: {e}")
-        return jsonify({
+        return _json_resp({
             'error': 'Authentication service unavailable',
             'success': False
-        }), 503
+        }, 503)
 
 @app.route('/api/logout', methods=['POST'])
 @jwt_required
@@ -615,12 +777,12 @@ def logout():
         pass  # Ignore auth service errors during logout
 
     session.clear()
-    return jsonify({'success': True, 'message': 'Logged out successfully'})
+    return _json_resp({'success': True, 'message': 'Logged out successfully'})
 
 @app.route('/api/generate-api-key', methods=['POST'])
 @jwt_required
 def generate_api_key():
-    data = request.get_json() or {}
+    data = _json_body() or {}
     name = data.get('name', 'CLI Key')
 
     try:
@@ -631,24 +793,24 @@ def generate_api_key():
                                timeout=10)
 
         if response.status_code == 200:
-            return jsonify({
+            return _json_resp({
                 'success': True,
                 'api_key': response.json()['apiKey'],
                 'name': response.json()['name']
             })
         else:
             error_data = response.json() if response.content else {}
-            return jsonify({
+            return _json_resp({
                 'error': error_data.get('error', 'Failed to generate API key'),
                 'success': False
-            }), response.status_code
+            }, response.status_code)
 
     except requests.RequestException as e:
         logger.error(f"Auth service connection error: {e}")
-        return jsonify({
+        return _json_resp({
             'error': 'Authentication service unavailable',
             'success': False
-        }), 503
+        }, 503)
 
 @app.route('/api/list-api-keys', methods=['GET'])
 @jwt_required
@@ -660,30 +822,30 @@ def list_api_keys():
                               timeout=10)
 
         if response.status_code == 200:
-            return jsonify({
+            return _json_resp({
                 'success': True,
                 'api_keys': response.json()
             })
         else:
             error_data = response.json() if response.content else {}
-            return jsonify({
+            return _json_resp({
                 'error': error_data.get('error', 'Failed to list API keys'),
                 'success': False
-            }), response.status_code
+            }, response.status_code)
 
     except requests.RequestException as e:
         logger.error(f"Auth service connection error: {e}")
-        return jsonify({
+        return _json_resp({
             'error': 'Authentication service unavailable',
             'success': False
-        }), 503
+        }, 503)
 
 @app.route('/')
 @jwt_required
 def index():
     user = getattr(request, 'current_user', session.get('user', {}))
     username = user.get('username', 'Unknown')
-    logger.debug(f"Rendering index page for user: {username}")
+    logger.debug("Rendering index page for user: %s", username)
     return render_template('index.html', username=username)
 
 @app.route('/settings')
@@ -692,7 +854,7 @@ def settings_page():
     """Display the settings page."""
     user = getattr(request, 'current_user', session.get('user', {}))
     username = user.get('username', 'Unknown')
-    logger.debug(f"Rendering settings page for user: {username}")
+    logger.debug("Rendering settings page for user: %s", username)
     return render_template('settings.html', username=username)
 
 @app.route('/api/settings/data', methods=['GET'])
@@ -914,20 +1076,19 @@ def update_note():
 @app.route('/api/command', methods=['POST'])
 @jwt_required
 def execute_command():
-    command = request.json.get('command', '').strip()
-    logger.debug(f"Executing command: {command}")
+    command = _json_body().get('command', '').strip()
+    logger.debug("Executing command: %s", command)
 
     if not command:
-        return jsonify({'result': 'No command provided'})
+        return _json_resp({'result': 'No command provided'})
 
     try:
         # Get Notes manager with JWT token for this request
         notes_manager = get_notes_manager()
-        llm_helper = get_llm_helper()
     except Exception as e:
         logger.error(f"Failed to initialize Zettl components: {e}")
         error_msg = ZettlFormatter.error("Unable to connect to the database. Please check your authentication and try again.")
-        return jsonify({'result': process_for_web(error_msg)})
+        return _json_resp({'result': process_for_web(error_msg)})
 
     # Parse the command with better handling for options and quotes
     cmd, args = parse_command(command)
@@ -951,1611 +1112,1586 @@ def execute_command():
 
 
     # Extract options, flags and non-option args
-    options, flags, remaining_args = extract_options(args, cmd)
+    # Commands without arguments have nothing to parse
+    if args:
+        options, flags, remaining_args = extract_options(args, cmd)
+    else:
+        options, flags, remaining_args = {}, [], []
     
     try:
-        result = ""
-        
-        # Map commands to Zettl functions
-        if cmd == "list":
-            # Handle options
-            limit = int(options.get('limit', 10))
-            full = 'f' in flags or 'full' in flags
-            compact = 'c' in flags or 'compact' in flags
+        handler = _COMMAND_HANDLERS.get(cmd)
+        if handler is None:
+            result = f"Unknown command: {cmd}. Try 'help' for available commands."
+        else:
+            result = handler(cmd, options, flags, remaining_args, notes_manager)
+            # Handlers return early responses (errors, streamed output) as-is
+            if not isinstance(result, str):
+                return result
             
-            notes = notes_manager.list_notes(limit)
-            if not notes:
-                result = "No notes found."
-            else:
-                result = f"{ZettlFormatter.header(f'Recent Notes (showing {len(notes)} of {len(notes)})')}\n\n"
-                
+        logger.debug("Command result: %.100s...", result)
+
+        # Process result for web display
+        result = process_for_web(result)
+        return _json_resp({'result': result})
+        
+    except Exception as e:
+        logger.exception(f"Error executing command: {e}")
+
+        # Provide more specific error messages based on the type of error
+        error_str = str(e).lower()
+        if "401" in error_str or "unauthorized" in error_str:
+            error_msg = ZettlFormatter.error("Authentication failed. Please log out and log back in.")
+        elif "connection" in error_str or "timeout" in error_str:
+            error_msg = ZettlFormatter.error("Database connection error. Please try again.")
+        elif "404" in error_str or "not found" in error_str:
+            error_msg = ZettlFormatter.error("Requested resource not found.")
+        else:
+            error_msg = ZettlFormatter.error(f"Command execution failed: {str(e)}")
+
+        return _json_resp({'result': process_for_web(error_msg)})
+
+
+def _display_group(category_dict, uncategorized_list, header_text):
+    """Render todos/ideas/notes grouped by their combined category tags, uncategorized last."""
+    output = io.StringIO()
+    if header_text:
+        output.write(f"{header_text}\n\n")
+
+    if category_dict:
+        for category, notes in sorted(category_dict.items()):
+            category_display = " - ".join(map(_fmt_tag, category.split(" - ")))
+            output.write(f"{category_display} ({len(notes)})\n\n")
 
             for note in notes:
-                note_id = note['id']
-                created_at = notes_manager.db.format_timestamp(note['created_at'])
+                formatted_id = _fmt_note_id(note['id'])
+                output.write(f"  {formatted_id}:\n")
+                output.write(f"{note['content']}\n\n")
 
-                if compact:
-                    # Very compact mode - just IDs
-                    result += f"{ZettlFormatter.note_id(note_id)}\n"
-                elif full:
-                    # Full content mode
-                    result += f"{ZettlFormatter.note_id(note_id)} [{ZettlFormatter.timestamp(created_at)}]\n"
-                    result += "-" * 40 + "\n"
-                    result += f"{note['content']}\n"
+    if uncategorized_list:
+        output.write("Uncategorized\n\n")
+        for note in uncategorized_list:
+            formatted_id = _fmt_note_id(note['id'])
+            output.write(f"  {formatted_id}:\n")
+            output.write(f"{note['content']}\n\n")
 
-                    # Add tags display
-                    try:
-                        tags = notes_manager.get_tags(note_id)
-                        if tags:
-                            result += f"Tags: {', '.join([ZettlFormatter.tag(t) for t in tags])}\n"
-                    except Exception:
-                        pass
+    return output.getvalue()
+
+
+def _group_by_status(notes, tags_map, filters_lower, excluded_tags, show_all, cancel_flag, done_today_ids=()):
+    """Bucket listed todos/ideas/notes by status and combined category name.
+
+    Returns ``(groups, filter_matched)`` where ``groups`` maps each of
+    ``active``, ``done``, ``donetoday`` and ``canceled`` to a
+    ``(by_category, uncategorized, ids)`` tuple.
+    """
+    groups = {status: (defaultdict(list), [], set()) for status in ('active', 'done', 'donetoday', 'canceled')}
+    seen_ids = set()
+    filter_matched = False
+    combined_names = {}
+
+    for note in notes:
+        note_id = note['id']
+        # Group each note once, whatever bucket it lands in
+        if note_id in seen_ids:
+            continue
+        seen_ids.add(note_id)
+        tags = tags_map.get(note_id, ())
+        tags_lower = {t.lower() for t in tags}
+
+        # Apply tag filters if specified
+        if not filters_lower.issubset(tags_lower):
+            continue
+        filter_matched = True
+
+        # Run the skip checks before any categorization work
+        is_done = 'done' in tags_lower
+        is_done_today = note_id in done_today_ids
+
+        # Skip done notes if not explicitly included
+        if is_done and not show_all and not is_done_today:
+            continue
+
+        # Skip canceled notes if not explicitly requested
+        is_canceled = 'cancel' in tags_lower
+        if is_canceled and not cancel_flag:
+            continue
+
+        if is_canceled:
+            status = 'canceled'
+        elif is_done_today:
+            status = 'donetoday'
+        elif is_done:
+            status = 'done'
+        else:
+            status = 'active'
+        by_category, uncategorized, ids = groups[status]
+        ids.add(note_id)
+
+        # Find category tags
+        categories = [tag for tag in tags if tag.lower() not in excluded_tags]
+        if not categories:
+            uncategorized.append(note)
+            continue
+
+        # Notes sharing a tag combination reuse its sorted name
+        category_key = frozenset(categories)
+        combined_category = combined_names.get(category_key)
+        if combined_category is None:
+            combined_category = " - ".join(sorted(categories))
+            combined_names[category_key] = combined_category
+        by_category[combined_category].append(note)
+
+    return groups, filter_matched
+
+
+# Command handlers
+# Each takes the parsed command and returns the result text, or a finished
+# response for early exits.
+
+def _cmd_list(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the list command: show recent notes."""
+    # Handle options
+    limit = int(options.get('limit', 10))
+    full = 'f' in flags or 'full' in flags
+    compact = 'c' in flags or 'compact' in flags
+
+    notes = notes_manager.list_notes(limit)
+    if not notes:
+        parts = ["No notes found."]
+    else:
+        parts = [f"{ZettlFormatter.header(f'Recent Notes (showing {len(notes)} of {len(notes)})')}\n\n"]
+
+    # Prefetch tags for all notes in one request instead of one per note
+    tags_map = {}
+    if full and not compact and notes:
+        tags_map = _prefetch_tags(notes_manager, [note['id'] for note in notes])
 
-                    result += "\n"  # Extra line between notes
+    for note in notes:
+        note_id = note['id']
+
+        if compact:
+            # Very compact mode - just IDs
+            parts.append(f"{_fmt_note_id(note_id)}\n")
+        elif full:
+            # Full content mode
+            created_at = notes_manager.db.format_timestamp(note['created_at'])
+            parts.append(f"{_fmt_note_id(note_id)} [{_fmt_timestamp(created_at)}]\n")
+            parts.append(_SEP)
+            parts.append(f"{note['content']}\n")
+
+            # Add tags display
+            tags = tags_map.get(note_id, [])
+            if tags:
+                parts.append(f"Tags: {', '.join(map(_fmt_tag, tags))}\n")
+
+            parts.append("\n")  # Extra line between notes
+        else:
+            # Default mode - ID, timestamp, and preview
+            created_at = notes_manager.db.format_timestamp(note['created_at'])
+            formatted_id = _fmt_note_id(note_id)
+            formatted_time = _fmt_timestamp(created_at)
+            content_preview = _preview(note['content'])
+            parts.append(f"{formatted_id} [{formatted_time}]: {content_preview}\n\n")  # Added extra newline
+
+    result = "".join(parts)
+
+    return result
+
+
+def _cmd_tagged_notes(cmd, options, flags, remaining_args, notes_manager):
+    """Handle todo/idea/note/project: list notes with that tag, show a project, or create a note."""
+    result = ""
+    # Handle specialized note creation/listing commands with -l linking support
+
+    # Join remaining args into content string (support multiple words without quotes)
+    content = ' '.join(remaining_args) if remaining_args else ""
+
+    # Get link options (now supports multiple -l flags)
+    link_ids = options.get('link', [])
+    if isinstance(link_ids, str):
+        link_ids = [link_ids]
+
+    # Determine automatic tags based on command type
+    if cmd == "todo":
+        list_tag = 'todo'
+        auto_tags = ['todo']
+    elif cmd == "idea":
+        list_tag = 'idea'
+        auto_tags = ['idea']
+    elif cmd == "note":
+        list_tag = 'note'
+        auto_tags = ['note']
+    elif cmd == "project":
+        list_tag = 'project'
+        auto_tags = ['project']
+
+    # LIST MODE: If no content provided, list notes with that tag
+    if not content:
+        # Special handling for project list mode to show stats
+        if cmd == "project":
+            projects = notes_manager.get_notes_by_tag('project')
+
+            if not projects:
+                result = f"{ZettlFormatter.warning('No projects found.')}\n"
+            else:
+                parts = [f"{ZettlFormatter.header(f'Active Projects ({len(projects)} total)')}\n\n"]
+
+                # Get all project stats at once
+                try:
+                    all_stats = notes_manager.db.get_project_stats()
+                    stats_dict = {s['project_id']: s for s in all_stats}
+                except Exception:
+                    stats_dict = {}
+
+                for project in projects:
+                    project_id = project['id']
+
+                    # Get stats from the view
+                    stats_data = stats_dict.get(project_id, {'active_todos': 0, 'active_ideas': 0, 'active_notes': 0})
+                    todos_count = stats_data.get('active_todos', 0)
+                    ideas_count = stats_data.get('active_ideas', 0)
+                    notes_count = stats_data.get('active_notes', 0)
+
+                    stats = f"({todos_count} todos, {ideas_count} ideas, {notes_count} notes)"
+
+                    # Get content preview
+                    content_preview = project['content'].partition('\n')[0][:60]
+                    if len(project['content']) > 60:
+                        content_preview += "..."
+
+                    formatted_id = _fmt_note_id(project_id)
+                    parts.append(f"  {formatted_id} {stats}: {content_preview}\n\n")
+                result = "".join(parts)
+        elif cmd == "todo":
+            # TODO LIST MODE - Full CLI behavior with filtering
+            # Extract options
+            donetoday = 'donetoday' in options or 'dt' in flags
+            show_all = 'all' in options or 'a' in flags
+            cancel_flag = 'cancel' in options or 'c' in flags
+            filter_tags = []
+            if 'tag' in options:
+                if isinstance(options['tag'], list):
+                    filter_tags.extend(options['tag'])
                 else:
-                    # Default mode - ID, timestamp, and preview
-                    formatted_id = ZettlFormatter.note_id(note_id)
-                    formatted_time = ZettlFormatter.timestamp(created_at)
-                    content_preview = note['content'][:50] + "..." if len(note['content']) > 50 else note['content']
-                    result += f"{formatted_id} [{formatted_time}]: {content_preview}\n\n"  # Added extra newline
-
-
-        elif cmd in ["todo", "idea", "note", "project"]:
-            # Handle specialized note creation/listing commands with -l linking support
-
-            # Join remaining args into content string (support multiple words without quotes)
-            content = ' '.join(remaining_args) if remaining_args else ""
-
-            # Get link options (now supports multiple -l flags)
-            link_ids = options.get('link', [])
-            if isinstance(link_ids, str):
-                link_ids = [link_ids]
-
-            # Determine automatic tags based on command type
-            if cmd == "todo":
-                list_tag = 'todo'
-                auto_tags = ['todo']
-            elif cmd == "idea":
-                list_tag = 'idea'
-                auto_tags = ['idea']
-            elif cmd == "note":
-                list_tag = 'note'
-                auto_tags = ['note']
-            elif cmd == "project":
-                list_tag = 'project'
-                auto_tags = ['project']
-
-            # LIST MODE: If no content provided, list notes with that tag
-            if not content:
-                # Special handling for project list mode to show stats
-                if cmd == "project":
-                    projects = notes_manager.get_notes_by_tag('project')
-
-                    if not projects:
-                        result = f"{ZettlFormatter.warning('No projects found.')}\n"
-                    else:
-                        result = f"{ZettlFormatter.header(f'Active Projects ({len(projects)} total)')}\n\n"
+                    filter_tags.append(options['tag'])
+
+            # Get all notes tagged with 'todo'
+            todo_notes = notes_manager.get_notes_by_tag('todo')
 
-                        # Get all project stats at once
+            if not todo_notes:
+                result = ZettlFormatter.warning("No todos found.")
+            else:
+                # Standard todo list with filtering (same logic as todos command)
+                # Get notes with 'done' tag added today
+                done_today_ids = set()
+                if donetoday:
+                    try:
+                        done_today_ids.update(notes_manager.db.iter_note_ids_with_tag_today('done'))
+                    except Exception as e:
+                        result = ZettlFormatter.warning(f"Could not determine todos completed today: {str(e)}")
+
+                # Filter by project if @ mentions provided
+                if link_ids:
+                    project_filtered_notes = []
+                    project_filtered_ids = set()
+                    for project_id in link_ids:
                         try:
-                            all_stats = notes_manager.db.get_project_stats()
-                            stats_dict = {s['project_id']: s for s in all_stats}
+                            linked_notes = notes_manager.get_related_notes(project_id)
+                            linked_note_ids = {note['id'] for note in linked_notes}
+
+                            for note in todo_notes:
+                                note_id = note['id']
+                                if note_id in linked_note_ids and note_id not in project_filtered_ids:
+                                    project_filtered_ids.add(note_id)
+                                    project_filtered_notes.append(note)
                         except Exception:
-                            stats_dict = {}
-
-                        for project in projects:
-                            project_id = project['id']
-
-                            # Get stats from the view
-                            stats_data = stats_dict.get(project_id, {'active_todos': 0, 'active_ideas': 0, 'active_notes': 0})
-                            todos_count = stats_data.get('active_todos', 0)
-                            ideas_count = stats_data.get('active_ideas', 0)
-                            notes_count = stats_data.get('active_notes', 0)
-
-                            stats = f"({todos_count} todos, {ideas_count} ideas, {notes_count} notes)"
-
-                            # Get content preview
-                            content_preview = project['content'].split('\n')[0][:60]
-                            if len(project['content']) > 60:
-                                content_preview += "..."
-
-                            formatted_id = ZettlFormatter.note_id(project_id)
-                            result += f"  {formatted_id} {stats}: {content_preview}\n\n"
-                elif cmd == "todo":
-                    # TODO LIST MODE - Full CLI behavior with filtering
-                    # Extract options
-                    donetoday = 'donetoday' in options or 'dt' in flags
-                    show_all = 'all' in options or 'a' in flags
-                    cancel_flag = 'cancel' in options or 'c' in flags
-                    filter_tags = []
-                    if 'tag' in options:
-                        if isinstance(options['tag'], list):
-                            filter_tags.extend(options['tag'])
-                        else:
-                            filter_tags.append(options['tag'])
+                            pass
 
-                    # Get all notes tagged with 'todo'
-                    todo_notes = notes_manager.get_notes_by_tag('todo')
+                    todo_notes = project_filtered_notes
 
                     if not todo_notes:
-                        result = ZettlFormatter.warning("No todos found.")
+                        links_str = "', '".join(link_ids)
+                        result = ZettlFormatter.warning(f"No todos found linked to: '{links_str}'.")
+                        return _json_resp({'result': process_for_web(result)})
+
+                # Fetch tags for all notes in one request instead of one per note.
+                # Status comes from the tags, so a failed fetch is reported, not skipped.
+                tags_map = notes_manager.get_tags_bulk([note['id'] for note in todo_notes])
+
+                # Lowercase the filters once; they are also left out of the category names
+                filters_lower = frozenset(f.lower() for f in filter_tags)
+                excluded_tags = filters_lower | {'todo', 'done', 'cancel'}
+
+                # Group notes by status and category
+                groups, filter_matched = _group_by_status(
+                    todo_notes, tags_map, filters_lower, excluded_tags, show_all, cancel_flag,
+                    done_today_ids if donetoday else ())
+                active_todos_by_category, uncategorized_active, unique_active_ids = groups['active']
+                done_todos_by_category, uncategorized_done, unique_done_ids = groups['done']
+                donetoday_todos_by_category, uncategorized_donetoday, unique_donetoday_ids = groups['donetoday']
+                canceled_todos_by_category, uncategorized_canceled, unique_canceled_ids = groups['canceled']
+                any_matched = any(ids for _, _, ids in groups.values())
+
+                if filter_tags and not filter_matched:
+                    filter_str = "', '".join(filter_tags)
+                    result = ZettlFormatter.warning(f"No todos found with all tags: '{filter_str}'.")
+                    return _json_resp({'result': process_for_web(result)})
+
+                # Build header
+                header_parts = ["Todos"]
+                if filter_tags:
+                    filter_str = "', '".join(filter_tags)
+                    header_parts.append(f"tagged with '{filter_str}'")
+                header_suffix = ' '.join(header_parts)
+
+                # Check if there are any todos to display
+                if not any_matched:
+                    result = ZettlFormatter.warning("No todos match your criteria.")
+                    return _json_resp({'result': process_for_web(result)})
+
+                # Display active todos
+                sections = []
+                if active_todos_by_category or uncategorized_active:
+                    active_header = ZettlFormatter.header(f"Active {header_suffix} ({len(unique_active_ids)} total)")
+                    sections.append(_display_group(active_todos_by_category, uncategorized_active, active_header))
+
+                # Display done today todos
+                if donetoday:
+                    if donetoday_todos_by_category or uncategorized_donetoday:
+                        donetoday_header = ZettlFormatter.header(f"Completed Today {header_suffix} ({len(unique_donetoday_ids)} total)")
+                        sections.append("\n" + _display_group(donetoday_todos_by_category, uncategorized_donetoday, donetoday_header))
                     else:
-                        # Standard todo list with filtering (same logic as todos command)
-                        # Get notes with 'done' tag added today
-                        done_today_ids = set()
-                        if donetoday:
-                            try:
-                                done_tags_today = notes_manager.db.get_tags_created_today('done')
-                                for tag_data in done_tags_today:
-                                    note_id = tag_data.get('note_id')
-                                    if note_id:
-                                        done_today_ids.add(note_id)
-                            except Exception as e:
-                                result = ZettlFormatter.warning(f"Could not determine todos completed today: {str(e)}")
-
-                        # Filter by project if @ mentions provided
-                        if link_ids:
-                            project_filtered_notes = []
-                            for project_id in link_ids:
-                                try:
-                                    linked_notes = notes_manager.get_related_notes(project_id)
-                                    linked_note_ids = {note['id'] for note in linked_notes}
-
-                                    for note in todo_notes:
-                                        if note['id'] in linked_note_ids:
-                                            if note not in project_filtered_notes:
-                                                project_filtered_notes.append(note)
-                                except Exception:
-                                    pass
-
-                            todo_notes = project_filtered_notes
-
-                            if not todo_notes:
-                                links_str = "', '".join(link_ids)
-                                result = ZettlFormatter.warning(f"No todos found linked to: '{links_str}'.")
-                                return jsonify({'result': process_for_web(result)})
-
-                        # Apply tag filters if specified
-                        if filter_tags:
-                            filtered_notes = []
-                            for note in todo_notes:
-                                note_id = note['id']
-                                tags = [t.lower() for t in notes_manager.get_tags(note_id)]
-
-                                if all(f.lower() in tags for f in filter_tags):
-                                    filtered_notes.append(note)
-
-                            todo_notes = filtered_notes
-
-                            if not todo_notes:
-                                filter_str = "', '".join(filter_tags)
-                                result = ZettlFormatter.warning(f"No todos found with all tags: '{filter_str}'.")
-                                return jsonify({'result': process_for_web(result)})
-
-                        # Group notes by status and category
-                        active_todos_by_category = {}
-                        done_todos_by_category = {}
-                        donetoday_todos_by_category = {}
-                        canceled_todos_by_category = {}
-                        uncategorized_active = []
-                        uncategorized_done = []
-                        uncategorized_donetoday = []
-                        uncategorized_canceled = []
-
-                        unique_active_ids = set()
-                        unique_done_ids = set()
-                        unique_donetoday_ids = set()
-                        unique_canceled_ids = set()
-
-                        for note in todo_notes:
-                            note_id = note['id']
-                            tags = notes_manager.get_tags(note_id)
-                            tags_lower = [t.lower() for t in tags]
-
-                            is_done = 'done' in tags_lower
-                            is_canceled = 'cancel' in tags_lower
-                            is_done_today = note_id in done_today_ids
-
-                            # Skip done todos if not explicitly included
-                            if is_done and not show_all and not (is_done_today and donetoday):
-                                continue
-
-                            # Skip canceled todos if not explicitly requested
-                            if is_canceled and not cancel_flag:
-                                continue
-
-                            # Track unique IDs
-                            if is_canceled:
-                                unique_canceled_ids.add(note_id)
-                            elif is_done_today and donetoday:
-                                unique_donetoday_ids.add(note_id)
-                            elif is_done:
-                                unique_done_ids.add(note_id)
-                            else:
-                                unique_active_ids.add(note_id)
-
-                            # Find category tags
-                            excluded_tags = ['todo', 'done', 'cancel']
-                            if filter_tags:
-                                excluded_tags.extend([f.lower() for f in filter_tags])
-
-                            categories = [tag for tag in tags if tag.lower() not in excluded_tags]
-
-                            # Assign to category group
-                            if not categories:
-                                if is_canceled:
-                                    uncategorized_canceled.append(note)
-                                elif is_done_today and donetoday:
-                                    uncategorized_donetoday.append(note)
-                                elif is_done:
-                                    uncategorized_done.append(note)
-                                else:
-                                    uncategorized_active.append(note)
-                            else:
-                                combined_category = " - ".join(sorted(categories))
-
-                                if is_canceled:
-                                    if combined_category not in canceled_todos_by_category:
-                                        canceled_todos_by_category[combined_category] = []
-                                    if note not in canceled_todos_by_category[combined_category]:
-                                        canceled_todos_by_category[combined_category].append(note)
-                                elif is_done_today and donetoday:
-                                    if combined_category not in donetoday_todos_by_category:
-                                        donetoday_todos_by_category[combined_category] = []
-                                    if note not in donetoday_todos_by_category[combined_category]:
-                                        donetoday_todos_by_category[combined_category].append(note)
-                                elif is_done:
-                                    if combined_category not in done_todos_by_category:
-                                        done_todos_by_category[combined_category] = []
-                                    if note not in done_todos_by_category[combined_category]:
-                                        done_todos_by_category[combined_category].append(note)
-                                else:
-                                    if combined_category not in active_todos_by_category:
-                                        active_todos_by_category[combined_category] = []
-                                    if note not in active_todos_by_category[combined_category]:
-                                        active_todos_by_category[combined_category].append(note)
-
-                        # Build header
-                        header_parts = ["Todos"]
-                        if filter_tags:
-                            filter_str = "', '".join(filter_tags)
-                            header_parts.append(f"tagged with '{filter_str}'")
-
-                        # Check if there are any todos to display
-                        if (not active_todos_by_category and not uncategorized_active and
-                            (not show_all or (not done_todos_by_category and not uncategorized_done)) and
-                            (not donetoday or (not donetoday_todos_by_category and not uncategorized_donetoday)) and
-                            (not cancel_flag or (not canceled_todos_by_category and not uncategorized_canceled))):
-                            result = ZettlFormatter.warning("No todos match your criteria.")
-                            return jsonify({'result': process_for_web(result)})
-
-                        # Helper function to display todos
-                        def display_todos_group(category_dict, uncategorized_list, header_text):
-                            output = ""
-                            if header_text:
-                                output += f"{header_text}\n\n"
-
-                            if category_dict:
-                                for category, notes in sorted(category_dict.items()):
-                                    if " - " in category:
-                                        tags_in_cat = category.split(" - ")
-                                        formatted_tags = [ZettlFormatter.tag(t) for t in tags_in_cat]
-                                        category_display = " - ".join(formatted_tags)
-                                        output += f"{category_display} ({len(notes)})\n\n"
-                                    else:
-                                        output += f"{ZettlFormatter.tag(category)} ({len(notes)})\n\n"
-
-                                    for note in notes:
-                                        formatted_id = ZettlFormatter.note_id(note['id'])
-                                        output += f"  {formatted_id}:\n"
-                                        output += f"{note['content']}\n\n"
-
-                            if uncategorized_list:
-                                output += "Uncategorized\n\n"
-                                for note in uncategorized_list:
-                                    formatted_id = ZettlFormatter.note_id(note['id'])
-                                    output += f"  {formatted_id}:\n"
-                                    output += f"{note['content']}\n\n"
-
-                            return output
-
-                        # Display active todos
-                        result = ""
-                        if active_todos_by_category or uncategorized_active:
-                            active_header = ZettlFormatter.header(f"Active {' '.join(header_parts)} ({len(unique_active_ids)} total)")
-                            result += display_todos_group(active_todos_by_category, uncategorized_active, active_header)
-
-                        # Display done today todos
-                        if donetoday:
-                            if donetoday_todos_by_category or uncategorized_donetoday:
-                                donetoday_header = ZettlFormatter.header(f"Completed Today {' '.join(header_parts)} ({len(unique_donetoday_ids)} total)")
-                                result += "\n" + display_todos_group(donetoday_todos_by_category, uncategorized_donetoday, donetoday_header)
-                            else:
-                                result += "\n" + ZettlFormatter.warning("No todos were completed today.")
-
-                        # Display all done todos
-                        if show_all and (done_todos_by_category or uncategorized_done):
-                            if donetoday:
-                                for category in list(done_todos_by_category.keys()):
-                                    done_todos_by_category[category] = [
-                                        note for note in done_todos_by_category[category]
-                                        if note['id'] not in done_today_ids
-                                    ]
-                                    if not done_todos_by_category[category]:
-                                        del done_todos_by_category[category]
-
-                                uncategorized_done = [
-                                    note for note in uncategorized_done
-                                    if note['id'] not in done_today_ids
-                                ]
-
-                            if done_todos_by_category or uncategorized_done:
-                                done_header = ZettlFormatter.header(f"Completed {' '.join(header_parts)} ({len(unique_done_ids - unique_donetoday_ids)} total)")
-                                result += "\n" + display_todos_group(done_todos_by_category, uncategorized_done, done_header)
-
-                        # Display canceled todos
-                        if cancel_flag and (canceled_todos_by_category or uncategorized_canceled):
-                            canceled_header = ZettlFormatter.header(f"Canceled {' '.join(header_parts)} ({len(unique_canceled_ids)} total)")
-                            result += "\n" + display_todos_group(canceled_todos_by_category, uncategorized_canceled, canceled_header)
-
-                elif cmd == "idea":
-                    # IDEA LIST MODE - Full CLI behavior with filtering
-                    # Extract options
-                    show_all = 'all' in options or 'a' in flags
-                    cancel_flag = 'cancel' in options or 'c' in flags
-                    filter_tags = []
-                    if 'tag' in options:
-                        if isinstance(options['tag'], list):
-                            filter_tags.extend(options['tag'])
-                        else:
-                            filter_tags.append(options['tag'])
+                        sections.append("\n" + ZettlFormatter.warning("No todos were completed today."))
+
+                # Display all done todos
+                if show_all and (done_todos_by_category or uncategorized_done):
+                    if donetoday:
+                        # Rebuild without today's completions, dropping categories left empty
+                        done_todos_by_category = {
+                            category: kept
+                            for category, notes in done_todos_by_category.items()
+                            if (kept := [note for note in notes if note['id'] not in done_today_ids])
+                        }
 
-                    # Get all notes tagged with 'idea'
-                    idea_notes = notes_manager.get_notes_by_tag('idea')
+                        uncategorized_done = [
+                            note for note in uncategorized_done
+                            if note['id'] not in done_today_ids
+                        ]
+
+                    if done_todos_by_category or uncategorized_done:
+                        done_header = ZettlFormatter.header(f"Completed {header_suffix} ({len(unique_done_ids - unique_donetoday_ids)} total)")
+                        sections.append("\n" + _display_group(done_todos_by_category, uncategorized_done, done_header))
+
+                # Display canceled todos
+                if cancel_flag and (canceled_todos_by_category or uncategorized_canceled):
+                    canceled_header = ZettlFormatter.header(f"Canceled {header_suffix} ({len(unique_canceled_ids)} total)")
+                    sections.append("\n" + _display_group(canceled_todos_by_category, uncategorized_canceled, canceled_header))
+
+                result = "".join(sections)
+
+        elif cmd == "idea":
+            # IDEA LIST MODE - Full CLI behavior with filtering
+            # Extract options
+            show_all = 'all' in options or 'a' in flags
+            cancel_flag = 'cancel' in options or 'c' in flags
+            filter_tags = []
+            if 'tag' in options:
+                if isinstance(options['tag'], list):
+                    filter_tags.extend(options['tag'])
+                else:
+                    filter_tags.append(options['tag'])
+
+            # Get all notes tagged with 'idea'
+            idea_notes = notes_manager.get_notes_by_tag('idea')
+
+            if not idea_notes:
+                result = ZettlFormatter.warning("No ideas found.")
+            else:
+                # Filter by project if @ mentions provided
+                if link_ids:
+                    project_filtered_notes = []
+                    project_filtered_ids = set()
+                    for project_id in link_ids:
+                        try:
+                            linked_notes = notes_manager.get_related_notes(project_id)
+                            linked_note_ids = {note['id'] for note in linked_notes}
 
-                    if not idea_notes:
-                        result = ZettlFormatter.warning("No ideas found.")
-                    else:
-                        # Filter by project if @ mentions provided
-                        if link_ids:
-                            project_filtered_notes = []
-                            for project_id in link_ids:
-                                try:
-                                    linked_notes = notes_manager.get_related_notes(project_id)
-                                    linked_note_ids = {note['id'] for note in linked_notes}
-
-                                    for note in idea_notes:
-                                        if note['id'] in linked_note_ids:
-                                            if note not in project_filtered_notes:
-                                                project_filtered_notes.append(note)
-                                except Exception:
-                                    pass
-
-                            idea_notes = project_filtered_notes
-
-                            if not idea_notes:
-                                links_str = "', '".join(link_ids)
-                                result = ZettlFormatter.warning(f"No ideas found linked to: '{links_str}'.")
-                                return jsonify({'result': process_for_web(result)})
-
-                        # Apply tag filters if specified
-                        if filter_tags:
-                            filtered_notes = []
                             for note in idea_notes:
                                 note_id = note['id']
-                                tags = [t.lower() for t in notes_manager.get_tags(note_id)]
-
-                                if all(f.lower() in tags for f in filter_tags):
-                                    filtered_notes.append(note)
-
-                            idea_notes = filtered_notes
-
-                            if not idea_notes:
-                                filter_str = "', '".join(filter_tags)
-                                result = ZettlFormatter.warning(f"No ideas found with all tags: '{filter_str}'.")
-                                return jsonify({'result': process_for_web(result)})
-
-                        # Group by status and category
-                        active_by_category = {}
-                        done_by_category = {}
-                        canceled_by_category = {}
-                        uncategorized_active = []
-                        uncategorized_done = []
-                        uncategorized_canceled = []
-
-                        unique_active_ids = set()
-                        unique_done_ids = set()
-                        unique_canceled_ids = set()
-
-                        for note in idea_notes:
-                            note_id = note['id']
-                            tags = notes_manager.get_tags(note_id)
-                            tags_lower = [t.lower() for t in tags]
-
-                            is_done = 'done' in tags_lower
-                            is_canceled = 'cancel' in tags_lower
-
-                            # Skip done ideas if not explicitly included
-                            if is_done and not show_all:
-                                continue
-
-                            # Skip canceled ideas if not explicitly requested
-                            if is_canceled and not cancel_flag:
-                                continue
-
-                            # Track unique IDs
-                            if is_canceled:
-                                unique_canceled_ids.add(note_id)
-                            elif is_done:
-                                unique_done_ids.add(note_id)
-                            else:
-                                unique_active_ids.add(note_id)
-
-                            # Find category tags
-                            excluded_tags = ['idea', 'done', 'cancel']
-                            if filter_tags:
-                                excluded_tags.extend([f.lower() for f in filter_tags])
-
-                            categories = [tag for tag in tags if tag.lower() not in excluded_tags]
-
-                            # Assign to category group
-                            if not categories:
-                                if is_canceled:
-                                    uncategorized_canceled.append(note)
-                                elif is_done:
-                                    uncategorized_done.append(note)
-                                else:
-                                    uncategorized_active.append(note)
-                            else:
-                                combined_category = " - ".join(sorted(categories))
-
-                                if is_canceled:
-                                    if combined_category not in canceled_by_category:
-                                        canceled_by_category[combined_category] = []
-                                    if note not in canceled_by_category[combined_category]:
-                                        canceled_by_category[combined_category].append(note)
-                                elif is_done:
-                                    if combined_category not in done_by_category:
-                                        done_by_category[combined_category] = []
-                                    if note not in done_by_category[combined_category]:
-                                        done_by_category[combined_category].append(note)
-                                else:
-                                    if combined_category not in active_by_category:
-                                        active_by_category[combined_category] = []
-                                    if note not in active_by_category[combined_category]:
-                                        active_by_category[combined_category].append(note)
-
-                        # Build header
-                        header_parts = ["Ideas"]
-                        if filter_tags:
-                            filter_str = "', '".join(filter_tags)
-                            header_parts.append(f"tagged with '{filter_str}'")
-
-                        # Check if there are any ideas to display
-                        if (not active_by_category and not uncategorized_active and
-                            (not show_all or (not done_by_category and not uncategorized_done)) and
-                            (not cancel_flag or (not canceled_by_category and not uncategorized_canceled))):
-                            result = ZettlFormatter.warning("No ideas match your criteria.")
-                            return jsonify({'result': process_for_web(result)})
-
-                        # Helper function
-                        def display_group(category_dict, uncategorized_list, header_text):
-                            output = ""
-                            if header_text:
-                                output += f"{header_text}\n\n"
-
-                            if category_dict:
-                                for category, notes_list in sorted(category_dict.items()):
-                                    if " - " in category:
-                                        tags_in_cat = category.split(" - ")
-                                        formatted_tags = [ZettlFormatter.tag(t) for t in tags_in_cat]
-                                        category_display = " - ".join(formatted_tags)
-                                        output += f"{category_display} ({len(notes_list)})\n\n"
-                                    else:
-                                        output += f"{ZettlFormatter.tag(category)} ({len(notes_list)})\n\n"
-
-                                    for note in notes_list:
-                                        formatted_id = ZettlFormatter.note_id(note['id'])
-                                        output += f"  {formatted_id}:\n"
-                                        output += f"{note['content']}\n\n"
-
-                            if uncategorized_list:
-                                output += "Uncategorized\n\n"
-                                for note in uncategorized_list:
-                                    formatted_id = ZettlFormatter.note_id(note['id'])
-                                    output += f"  {formatted_id}:\n"
-                                    output += f"{note['content']}\n\n"
-
-                            return output
-
-                        # Display results
-                        result = ""
-                        if active_by_category or uncategorized_active:
-                            active_header = ZettlFormatter.header(f"Active {' '.join(header_parts)} ({len(unique_active_ids)} total)")
-                            result += display_group(active_by_category, uncategorized_active, active_header)
-
-                        if show_all and (done_by_category or uncategorized_done):
-                            done_header = ZettlFormatter.header(f"Completed {' '.join(header_parts)} ({len(unique_done_ids)} total)")
-                            result += "\n" + display_group(done_by_category, uncategorized_done, done_header)
-
-                        if cancel_flag and (canceled_by_category or uncategorized_canceled):
-                            canceled_header = ZettlFormatter.header(f"Canceled {' '.join(header_parts)} ({len(unique_canceled_ids)} total)")
-                            result += "\n" + display_group(canceled_by_category, uncategorized_canceled, canceled_header)
-
-                elif cmd == "note":
-                    # NOTE LIST MODE - Full CLI behavior with filtering
-                    # Extract options
-                    show_all = 'all' in options or 'a' in flags
-                    cancel_flag = 'cancel' in options or 'c' in flags
-                    filter_tags = []
-                    if 'tag' in options:
-                        if isinstance(options['tag'], list):
-                            filter_tags.extend(options['tag'])
-                        else:
-                            filter_tags.append(options['tag'])
+                                if note_id in linked_note_ids and note_id not in project_filtered_ids:
+                                    project_filtered_ids.add(note_id)
+                                    project_filtered_notes.append(note)
+                        except Exception:
+                            pass
 
-                    # Get all notes tagged with 'note'
-                    note_notes = notes_manager.get_notes_by_tag('note')
+                    idea_notes = project_filtered_notes
+
+                    if not idea_notes:
+                        links_str = "', '".join(link_ids)
+                        result = ZettlFormatter.warning(f"No ideas found linked to: '{links_str}'.")
+                        return _json_resp({'result': process_for_web(result)})
+
+                # Fetch tags for all notes in one request instead of one per note.
+                # Status comes from the tags, so a failed fetch is reported, not skipped.
+                tags_map = notes_manager.get_tags_bulk([note['id'] for note in idea_notes])
+
+                # Lowercase the filters once; they are also left out of the category names
+                filters_lower = frozenset(f.lower() for f in filter_tags)
+                excluded_tags = filters_lower | {'idea', 'done', 'cancel'}
+
+                # Group notes by status and category
+                groups, filter_matched = _group_by_status(
+                    idea_notes, tags_map, filters_lower, excluded_tags, show_all, cancel_flag)
+                active_by_category, uncategorized_active, unique_active_ids = groups['active']
+                done_by_category, uncategorized_done, unique_done_ids = groups['done']
+                canceled_by_category, uncategorized_canceled, unique_canceled_ids = groups['canceled']
+                any_matched = any(ids for _, _, ids in groups.values())
+
+                if filter_tags and not filter_matched:
+                    filter_str = "', '".join(filter_tags)
+                    result = ZettlFormatter.warning(f"No ideas found with all tags: '{filter_str}'.")
+                    return _json_resp({'result': process_for_web(result)})
+
+                # Build header
+                header_parts = ["Ideas"]
+                if filter_tags:
+                    filter_str = "', '".join(filter_tags)
+                    header_parts.append(f"tagged with '{filter_str}'")
+                header_suffix = ' '.join(header_parts)
+
+                # Check if there are any ideas to display
+                if not any_matched:
+                    result = ZettlFormatter.warning("No ideas match your criteria.")
+                    return _json_resp({'result': process_for_web(result)})
+
+                # Display results
+                sections = []
+                if active_by_category or uncategorized_active:
+                    active_header = ZettlFormatter.header(f"Active {header_suffix} ({len(unique_active_ids)} total)")
+                    sections.append(_display_group(active_by_category, uncategorized_active, active_header))
+
+                if show_all and (done_by_category or uncategorized_done):
+                    done_header = ZettlFormatter.header(f"Completed {header_suffix} ({len(unique_done_ids)} total)")
+                    sections.append("\n" + _display_group(done_by_category, uncategorized_done, done_header))
+
+                if cancel_flag and (canceled_by_category or uncategorized_canceled):
+                    canceled_header = ZettlFormatter.header(f"Canceled {header_suffix} ({len(unique_canceled_ids)} total)")
+                    sections.append("\n" + _display_group(canceled_by_category, uncategorized_canceled, canceled_header))
+
+                result = "".join(sections)
+
+        elif cmd == "note":
+            # NOTE LIST MODE - Full CLI behavior with filtering
+            # Extract options
+            show_all = 'all' in options or 'a' in flags
+            cancel_flag = 'cancel' in options or 'c' in flags
+            filter_tags = []
+            if 'tag' in options:
+                if isinstance(options['tag'], list):
+                    filter_tags.extend(options['tag'])
+                else:
+                    filter_tags.append(options['tag'])
+
+            # Get all notes tagged with 'note'
+            note_notes = notes_manager.get_notes_by_tag('note')
+
+            if not note_notes:
+                result = ZettlFormatter.warning("No notes found.")
+            else:
+                # Filter by project if @ mentions provided
+                if link_ids:
+                    project_filtered_notes = []
+                    project_filtered_ids = set()
+                    for project_id in link_ids:
+                        try:
+                            linked_notes = notes_manager.get_related_notes(project_id)
+                            linked_note_ids = {note['id'] for note in linked_notes}
 
-                    if not note_notes:
-                        result = ZettlFormatter.warning("No notes found.")
-                    else:
-                        # Filter by project if @ mentions provided
-                        if link_ids:
-                            project_filtered_notes = []
-                            for project_id in link_ids:
-                                try:
-                                    linked_notes = notes_manager.get_related_notes(project_id)
-                                    linked_note_ids = {note['id'] for note in linked_notes}
-
-                                    for note in note_notes:
-                                        if note['id'] in linked_note_ids:
-                                            if note not in project_filtered_notes:
-                                                project_filtered_notes.append(note)
-                                except Exception:
-                                    pass
-
-                            note_notes = project_filtered_notes
-
-                            if not note_notes:
-                                links_str = "', '".join(link_ids)
-                                result = ZettlFormatter.warning(f"No notes found linked to: '{links_str}'.")
-                                return jsonify({'result': process_for_web(result)})
-
-                        # Apply tag filters if specified
-                        if filter_tags:
-                            filtered_notes = []
                             for note in note_notes:
                                 note_id = note['id']
-                                tags = [t.lower() for t in notes_manager.get_tags(note_id)]
-
-                                if all(f.lower() in tags for f in filter_tags):
-                                    filtered_notes.append(note)
-
-                            note_notes = filtered_notes
-
-                            if not note_notes:
-                                filter_str = "', '".join(filter_tags)
-                                result = ZettlFormatter.warning(f"No notes found with all tags: '{filter_str}'.")
-                                return jsonify({'result': process_for_web(result)})
-
-                        # Group by status and category
-                        active_by_category = {}
-                        done_by_category = {}
-                        canceled_by_category = {}
-                        uncategorized_active = []
-                        uncategorized_done = []
-                        uncategorized_canceled = []
-
-                        unique_active_ids = set()
-                        unique_done_ids = set()
-                        unique_canceled_ids = set()
-
-                        for note in note_notes:
-                            note_id = note['id']
-                            tags = notes_manager.get_tags(note_id)
-                            tags_lower = [t.lower() for t in tags]
-
-                            is_done = 'done' in tags_lower
-                            is_canceled = 'cancel' in tags_lower
-
-                            # Skip done notes if not explicitly included
-                            if is_done and not show_all:
-                                continue
-
-                            # Skip canceled notes if not explicitly requested
-                            if is_canceled and not cancel_flag:
-                                continue
-
-                            # Track unique IDs
-                            if is_canceled:
-                                unique_canceled_ids.add(note_id)
-                            elif is_done:
-                                unique_done_ids.add(note_id)
-                            else:
-                                unique_active_ids.add(note_id)
-
-                            # Find category tags
-                            excluded_tags = ['note', 'done', 'cancel']
-                            if filter_tags:
-                                excluded_tags.extend([f.lower() for f in filter_tags])
-
-                            categories = [tag for tag in tags if tag.lower() not in excluded_tags]
-
-                            # Assign to category group
-                            if not categories:
-                                if is_canceled:
-                                    uncategorized_canceled.append(note)
-                                elif is_done:
-                                    uncategorized_done.append(note)
-                                else:
-                                    uncategorized_active.append(note)
-                            else:
-                                combined_category = " - ".join(sorted(categories))
-
-                                if is_canceled:
-                                    if combined_category not in canceled_by_category:
-                                        canceled_by_category[combined_category] = []
-                                    if note not in canceled_by_category[combined_category]:
-                                        canceled_by_category[combined_category].append(note)
-                                elif is_done:
-                                    if combined_category not in done_by_category:
-                                        done_by_category[combined_category] = []
-                                    if note not in done_by_category[combined_category]:
-                                        done_by_category[combined_category].append(note)
-                                else:
-                                    if combined_category not in active_by_category:
-                                        active_by_category[combined_category] = []
-                                    if note not in active_by_category[combined_category]:
-                                        active_by_category[combined_category].append(note)
-
-                        # Build header
-                        header_parts = ["Notes"]
-                        if filter_tags:
-                            filter_str = "', '".join(filter_tags)
-                            header_parts.append(f"tagged with '{filter_str}'")
-
-                        # Check if there are any notes to display
-                        if (not active_by_category and not uncategorized_active and
-                            (not show_all or (not done_by_category and not uncategorized_done)) and
-                            (not cancel_flag or (not canceled_by_category and not uncategorized_canceled))):
-                            result = ZettlFormatter.warning("No notes match your criteria.")
-                            return jsonify({'result': process_for_web(result)})
-
-                        # Helper function
-                        def display_group(category_dict, uncategorized_list, header_text):
-                            output = ""
-                            if header_text:
-                                output += f"{header_text}\n\n"
-
-                            if category_dict:
-                                for category, notes_list in sorted(category_dict.items()):
-                                    if " - " in category:
-                                        tags_in_cat = category.split(" - ")
-                                        formatted_tags = [ZettlFormatter.tag(t) for t in tags_in_cat]
-                                        category_display = " - ".join(formatted_tags)
-                                        output += f"{category_display} ({len(notes_list)})\n\n"
-                                    else:
-                                        output += f"{ZettlFormatter.tag(category)} ({len(notes_list)})\n\n"
-
-                                    for note in notes_list:
-                                        formatted_id = ZettlFormatter.note_id(note['id'])
-                                        output += f"  {formatted_id}:\n"
-                                        output += f"{note['content']}\n\n"
-
-                            if uncategorized_list:
-                                output += "Uncategorized\n\n"
-                                for note in uncategorized_list:
-                                    formatted_id = ZettlFormatter.note_id(note['id'])
-                                    output += f"  {formatted_id}:\n"
-                                    output += f"{note['content']}\n\n"
-
-                            return output
-
-                        # Display results
-                        result = ""
-                        if active_by_category or uncategorized_active:
-                            active_header = ZettlFormatter.header(f"Active {' '.join(header_parts)} ({len(unique_active_ids)} total)")
-                            result += display_group(active_by_category, uncategorized_active, active_header)
-
-                        if show_all and (done_by_category or uncategorized_done):
-                            done_header = ZettlFormatter.header(f"Completed {' '.join(header_parts)} ({len(unique_done_ids)} total)")
-                            result += "\n" + display_group(done_by_category, uncategorized_done, done_header)
-
-                        if cancel_flag and (canceled_by_category or uncategorized_canceled):
-                            canceled_header = ZettlFormatter.header(f"Canceled {' '.join(header_parts)} ({len(unique_canceled_ids)} total)")
-                            result += "\n" + display_group(canceled_by_category, uncategorized_canceled, canceled_header)
-
-            # DETAIL VIEW MODE (for project with -l) or CREATE MODE
+                                if note_id in linked_note_ids and note_id not in project_filtered_ids:
+                                    project_filtered_ids.add(note_id)
+                                    project_filtered_notes.append(note)
+                        except Exception:
+                            pass
+
+                    note_notes = project_filtered_notes
+
+                    if not note_notes:
+                        links_str = "', '".join(link_ids)
+                        result = ZettlFormatter.warning(f"No notes found linked to: '{links_str}'.")
+                        return _json_resp({'result': process_for_web(result)})
+
+                # Fetch tags for all notes in one request instead of one per note.
+                # Status comes from the tags, so a failed fetch is reported, not skipped.
+                tags_map = notes_manager.get_tags_bulk([note['id'] for note in note_notes])
+
+                # Lowercase the filters once; they are also left out of the category names
+                filters_lower = frozenset(f.lower() for f in filter_tags)
+                excluded_tags = filters_lower | {'note', 'done', 'cancel'}
+
+                # Group notes by status and category
+                groups, filter_matched = _group_by_status(
+                    note_notes, tags_map, filters_lower, excluded_tags, show_all, cancel_flag)
+                active_by_category, uncategorized_active, unique_active_ids = groups['active']
+                done_by_category, uncategorized_done, unique_done_ids = groups['done']
+                canceled_by_category, uncategorized_canceled, unique_canceled_ids = groups['canceled']
+                any_matched = any(ids for _, _, ids in groups.values())
+
+                if filter_tags and not filter_matched:
+                    filter_str = "', '".join(filter_tags)
+                    result = ZettlFormatter.warning(f"No notes found with all tags: '{filter_str}'.")
+                    return _json_resp({'result': process_for_web(result)})
+
+                # Build header
+                header_parts = ["Notes"]
+                if filter_tags:
+                    filter_str = "', '".join(filter_tags)
+                    header_parts.append(f"tagged with '{filter_str}'")
+                header_suffix = ' '.join(header_parts)
+
+                # Check if there are any notes to display
+                if not any_matched:
+                    result = ZettlFormatter.warning("No notes match your criteria.")
+                    return _json_resp({'result': process_for_web(result)})
+
+                # Display results
+                sections = []
+                if active_by_category or uncategorized_active:
+                    active_header = ZettlFormatter.header(f"Active {header_suffix} ({len(unique_active_ids)} total)")
+                    sections.append(_display_group(active_by_category, uncategorized_active, active_header))
+
+                if show_all and (done_by_category or uncategorized_done):
+                    done_header = ZettlFormatter.header(f"Completed {header_suffix} ({len(unique_done_ids)} total)")
+                    sections.append("\n" + _display_group(done_by_category, uncategorized_done, done_header))
+
+                if cancel_flag and (canceled_by_category or uncategorized_canceled):
+                    canceled_header = ZettlFormatter.header(f"Canceled {header_suffix} ({len(unique_canceled_ids)} total)")
+                    sections.append("\n" + _display_group(canceled_by_category, uncategorized_canceled, canceled_header))
+
+                result = "".join(sections)
+
+    # DETAIL VIEW MODE (for project with -l) or CREATE MODE
+    else:
+        # Check if this is a project command with -l option (DETAIL VIEW)
+        if cmd == "project" and link_ids:
+            if len(link_ids) > 1:
+                result = ZettlFormatter.warning("Please specify only one project to view details.\n")
             else:
-                # Check if this is a project command with -l option (DETAIL VIEW)
-                if cmd == "project" and link_ids:
-                    if len(link_ids) > 1:
-                        result = ZettlFormatter.warning("Please specify only one project to view details.\n")
+                project_id = link_ids[0]
+                try:
+                    # Try to get the project by ID
+                    project_note = notes_manager.get_note(project_id)
+                    project_tags = notes_manager.get_tags(project_id)
+
+                    # Verify it's a project
+                    if 'project' not in [t.lower() for t in project_tags]:
+                        result = ZettlFormatter.error(f"Note '{project_id}' is not a project.\n")
                     else:
-                        project_id = link_ids[0]
-                        try:
-                            # Try to get the project by ID
-                            project_note = notes_manager.get_note(project_id)
-                            project_tags = notes_manager.get_tags(project_id)
+                        # DETAIL VIEW MODE for project
+                        parts = ["═" * 63 + "\n"]
+                        parts.append(f"  PROJECT: {project_note['content'].partition(chr(10))[0][:40]} (#{project_id})\n")
+                        parts.append("═" * 63 + "\n\n")
 
-                            # Verify it's a project
-                            if 'project' not in [t.lower() for t in project_tags]:
-                                result = ZettlFormatter.error(f"Note '{project_id}' is not a project.\n")
-                            else:
-                                # DETAIL VIEW MODE for project
-                                result = "═" * 63 + "\n"
-                                result += f"  PROJECT: {project_note['content'].split(chr(10))[0][:40]} (#{project_id})\n"
-                                result += "═" * 63 + "\n\n"
-
-                                # Project content
-                                result += f"{project_note['content']}\n\n"
-
-                                # Tags
-                                if project_tags:
-                                    result += f"Tags: {', '.join([ZettlFormatter.tag(t) for t in project_tags])}\n\n"
-
-                                # Get linked notes (bidirectional)
-                                try:
-                                    linked_notes = notes_manager.get_related_notes(project_id)
-
-                                    if not linked_notes:
-                                        result += f"{ZettlFormatter.warning('No notes linked to this project.')}\n"
-                                    else:
-                                        # Categorize by note type
-                                        todos = []
-                                        ideas = []
-                                        notes_list = []
-
-                                        for n in linked_notes:
-                                            note_tags = notes_manager.get_tags(n['id'])
-                                            tags_lower = [t.lower() for t in note_tags]
-                                            n['all_tags'] = note_tags  # Store for later use
-
-                                            if 'todo' in tags_lower:
-                                                todos.append(n)
-                                            elif 'idea' in tags_lower:
-                                                ideas.append(n)
-                                            elif 'note' in tags_lower:
-                                                notes_list.append(n)
-
-                                        # Categorize by status
-                                        def categorize_by_status(note_list):
-                                            active, done, canceled = [], [], []
-                                            for n in note_list:
-                                                tags_lower = [t.lower() for t in n.get('all_tags', [])]
-                                                if 'cancel' in tags_lower:
-                                                    canceled.append(n)
-                                                elif 'done' in tags_lower:
-                                                    done.append(n)
-                                                else:
-                                                    active.append(n)
-                                            return active, done, canceled
-
-                                        todos_active, todos_done, todos_canceled = categorize_by_status(todos)
-                                        ideas_active, ideas_done, ideas_canceled = categorize_by_status(ideas)
-                                        notes_active, notes_done, notes_canceled = categorize_by_status(notes_list)
-
-                                        # Statistics section
-                                        result += "─" * 63 + "\n"
-                                        result += "  📊 STATISTICS\n"
-                                        result += "─" * 63 + "\n"
-                                        result += f"  📋 Todos:  {len(todos_active)} active, {len(todos_done)} done, {len(todos_canceled)} canceled\n"
-                                        result += f"  💡 Ideas:  {len(ideas_active)} active, {len(ideas_done)} done, {len(ideas_canceled)} canceled\n"
-                                        result += f"  📝 Notes:  {len(notes_active)} active, {len(notes_done)} done, {len(notes_canceled)} canceled\n"
-                                        result += f"  {'─' * 9}\n"
-                                        total_active = len(todos_active) + len(ideas_active) + len(notes_active)
-                                        total_done = len(todos_done) + len(ideas_done) + len(notes_done)
-                                        total_canceled = len(todos_canceled) + len(ideas_canceled) + len(notes_canceled)
-                                        result += f"  Total:     {total_active} active, {total_done} done, {total_canceled} canceled\n\n"
-
-                                        # Display active items
-                                        if todos_active:
-                                            result += "━" * 63 + "\n"
-                                            result += f"📋 ACTIVE TODOS ({len(todos_active)})\n"
-                                            result += "━" * 63 + "\n"
-                                            for note in todos_active:
-                                                formatted_id = ZettlFormatter.note_id(note['id'])
-                                                content_preview = note['content'][:80] if len(note['content']) > 80 else note['content']
-                                                if len(note['content']) > 80:
-                                                    content_preview += "..."
-                                                result += f"  {formatted_id}: {content_preview}\n"
-                                            result += "\n"
-
-                                        if ideas_active:
-                                            result += "━" * 63 + "\n"
-                                            result += f"💡 ACTIVE IDEAS ({len(ideas_active)})\n"
-                                            result += "━" * 63 + "\n"
-                                            for note in ideas_active:
-                                                formatted_id = ZettlFormatter.note_id(note['id'])
-                                                content_preview = note['content'][:80] if len(note['content']) > 80 else note['content']
-                                                if len(note['content']) > 80:
-                                                    content_preview += "..."
-                                                result += f"  {formatted_id}: {content_preview}\n"
-                                            result += "\n"
-
-                                        if notes_active:
-                                            result += "━" * 63 + "\n"
-                                            result += f"📝 ACTIVE NOTES ({len(notes_active)})\n"
-                                            result += "━" * 63 + "\n"
-                                            for note in notes_active:
-                                                formatted_id = ZettlFormatter.note_id(note['id'])
-                                                content_preview = note['content'][:80] if len(note['content']) > 80 else note['content']
-                                                if len(note['content']) > 80:
-                                                    content_preview += "..."
-                                                result += f"  {formatted_id}: {content_preview}\n"
-                                            result += "\n"
-
-                                except Exception as e:
-                                    result += f"{ZettlFormatter.error(f'Error getting linked notes: {str(e)}')}\n"
+                        # Project content
+                        parts.append(f"{project_note['content']}\n\n")
 
-                        except Exception as e:
-                            result = ZettlFormatter.error(f"Project '{project_id}' not found.\n")
-
-                # If we reach here, we're in CREATE MODE (or not a project detail view)
-                # Only execute create logic if result hasn't been set (i.e., not detail view)
-                if not result:
-                    # Get custom ID if provided
-                    custom_id = options.get('id', '')
-
-                    # Get tags from options
-                    tags = []
-                    if 'tag' in options:
-                        if isinstance(options['tag'], list):
-                            tags.extend(options['tag'])
-                        else:
-                            tags.append(options['tag'])
+                        # Tags
+                        if project_tags:
+                            parts.append(f"Tags: {', '.join(map(_fmt_tag, project_tags))}\n\n")
 
-                    # Create the note with custom ID if provided
-                    if custom_id:
+                        # Get linked notes (bidirectional)
                         try:
-                            from datetime import datetime
-                            now = datetime.now().isoformat()
-                            note_id = notes_manager.create_note_with_timestamp(content, now, custom_id)
-                            result = f"Created {cmd} #{note_id}\n"
-                        except Exception as e:
-                            # If custom ID already exists, use regular creation
-                            if "already exists" in str(e) or "duplicate" in str(e).lower():
-                                note_id = notes_manager.create_note(content)
-                                result = f"Created {cmd} #{note_id} (custom ID '{custom_id}' already exists)\n"
+                            linked_notes = notes_manager.get_related_notes(project_id)
+
+                            if not linked_notes:
+                                parts.append(f"{ZettlFormatter.warning('No notes linked to this project.')}\n")
                             else:
-                                raise e
-                    else:
-                        note_id = notes_manager.create_note(content)
-                        result = f"Created {cmd} #{note_id}\n"
+                                # Categorize by note type
+                                todos = []
+                                ideas = []
+                                notes_list = []
+
+                                tags_map = notes_manager.get_tags_bulk([n['id'] for n in linked_notes])
+                                for n in linked_notes:
+                                    note_tags = tags_map.get(n['id'], [])
+                                    tags_lower = {t.lower() for t in note_tags}
+                                    n['all_tags'] = note_tags  # Store for later use
+
+                                    if 'todo' in tags_lower:
+                                        todos.append(n)
+                                    elif 'idea' in tags_lower:
+                                        ideas.append(n)
+                                    elif 'note' in tags_lower:
+                                        notes_list.append(n)
+
+                                # Categorize by status
+                                def categorize_by_status(note_list):
+                                    active, done, canceled = [], [], []
+                                    for n in note_list:
+                                        tags_lower = {t.lower() for t in n.get('all_tags', [])}
+                                        if 'cancel' in tags_lower:
+                                            canceled.append(n)
+                                        elif 'done' in tags_lower:
+                                            done.append(n)
+                                        else:
+                                            active.append(n)
+                                    return active, done, canceled
+
+                                todos_active, todos_done, todos_canceled = categorize_by_status(todos)
+                                ideas_active, ideas_done, ideas_canceled = categorize_by_status(ideas)
+                                notes_active, notes_done, notes_canceled = categorize_by_status(notes_list)
+
+                                # Statistics section
+                                parts.append("─" * 63 + "\n")
+                                parts.append("  📊 STATISTICS\n")
+                                parts.append("─" * 63 + "\n")
+                                parts.append(f"  📋 Todos:  {len(todos_active)} active, {len(todos_done)} done, {len(todos_canceled)} canceled\n")
+                                parts.append(f"  💡 Ideas:  {len(ideas_active)} active, {len(ideas_done)} done, {len(ideas_canceled)} canceled\n")
+                                parts.append(f"  📝 Notes:  {len(notes_active)} active, {len(notes_done)} done, {len(notes_canceled)} canceled\n")
+                                parts.append(f"  {'─' * 9}\n")
+                                total_active = len(todos_active) + len(ideas_active) + len(notes_active)
+                                total_done = len(todos_done) + len(ideas_done) + len(notes_done)
+                                total_canceled = len(todos_canceled) + len(ideas_canceled) + len(notes_canceled)
+                                parts.append(f"  Total:     {total_active} active, {total_done} done, {total_canceled} canceled\n\n")
+
+                                # Display active items
+                                if todos_active:
+                                    parts.append("━" * 63 + "\n")
+                                    parts.append(f"📋 ACTIVE TODOS ({len(todos_active)})\n")
+                                    parts.append("━" * 63 + "\n")
+                                    for note in todos_active:
+                                        formatted_id = _fmt_note_id(note['id'])
+                                        content_preview = _preview(note['content'], 80)
+                                        parts.append(f"  {formatted_id}: {content_preview}\n")
+                                    parts.append("\n")
+
+                                if ideas_active:
+                                    parts.append("━" * 63 + "\n")
+                                    parts.append(f"💡 ACTIVE IDEAS ({len(ideas_active)})\n")
+                                    parts.append("━" * 63 + "\n")
+                                    for note in ideas_active:
+                                        formatted_id = _fmt_note_id(note['id'])
+                                        content_preview = _preview(note['content'], 80)
+                                        parts.append(f"  {formatted_id}: {content_preview}\n")
+                                    parts.append("\n")
+
+                                if notes_active:
+                                    parts.append("━" * 63 + "\n")
+                                    parts.append(f"📝 ACTIVE NOTES ({len(notes_active)})\n")
+                                    parts.append("━" * 63 + "\n")
+                                    for note in notes_active:
+                                        formatted_id = _fmt_note_id(note['id'])
+                                        content_preview = _preview(note['content'], 80)
+                                        parts.append(f"  {formatted_id}: {content_preview}\n")
+                                    parts.append("\n")
 
-                    # Add automatic tags
-                    for tag in auto_tags:
-                        try:
-                            notes_manager.add_tag(note_id, tag)
-                            result += f"Added tag '{tag}' to note #{note_id}\n"
                         except Exception as e:
-                            result += f"{ZettlFormatter.warning(f'Could not add tag {tag}: {str(e)}')}\n"
-
-                    # Add user-provided tags
-                    for tag in tags:
-                        if tag and tag not in auto_tags:
-                            try:
-                                notes_manager.add_tag(note_id, tag)
-                                result += f"Added tag '{tag}' to note #{note_id}\n"
-                            except Exception as e:
-                                result += f"{ZettlFormatter.warning(f'Could not add tag {tag}: {str(e)}')}\n"
-
-                    # Create links from -l options
-                    for link_id in link_ids:
-                        try:
-                            notes_manager.create_link(note_id, link_id)
-                            result += f"Created link from #{note_id} to #{link_id}\n"
-                        except Exception as e:
-                            result += f"{ZettlFormatter.warning(f'Could not create link to #{link_id}: {str(e)}')}\n"
+                            parts.append(f"{ZettlFormatter.error(f'Error getting linked notes: {str(e)}')}\n")
 
-        elif cmd == "show":
-            if not remaining_args:
-                result = ZettlFormatter.error("Please provide a note ID")
-            else:
-                note_id = remaining_args[0]
+                        result = "".join(parts)
+
+                except Exception as e:
+                    result = ZettlFormatter.error(f"Project '{project_id}' not found.\n")
+
+        # If we reach here, we're in CREATE MODE (or not a project detail view)
+        # Only execute create logic if result hasn't been set (i.e., not detail view)
+        if not result:
+            # Get custom ID if provided
+            custom_id = options.get('id', '')
+
+            # Get tags from options
+            tags = []
+            if 'tag' in options:
+                if isinstance(options['tag'], list):
+                    tags.extend(options['tag'])
+                else:
+                    tags.append(options['tag'])
 
+            # Create the note with custom ID if provided
+            if custom_id:
                 try:
-                    # Get the note using the standard method
-                    note = notes_manager.get_note(note_id)
-                    created_at = notes_manager.db.format_timestamp(note['created_at'])
+                    from datetime import datetime
+                    now = datetime.now().isoformat()
+                    note_id = notes_manager.create_note_with_timestamp(content, now, custom_id)
+                    parts = [f"Created {cmd} #{note_id}\n"]
+                except Exception as e:
+                    # If custom ID already exists, use regular creation
+                    if "already exists" in str(e) or "duplicate" in str(e).lower():
+                        note_id = notes_manager.create_note(content)
+                        parts = [f"Created {cmd} #{note_id} (custom ID '{custom_id}' already exists)\n"]
+                    else:
+                        raise e
+            else:
+                note_id = notes_manager.create_note(content)
+                parts = [f"Created {cmd} #{note_id}\n"]
 
-                    # Format header
-                    result = f"{ZettlFormatter.note_id(note_id)} [{ZettlFormatter.timestamp(created_at)}]\n"
-                    result += "-" * 40 + "\n"
-                    # Add content
-                    result += f"{note['content']}\n\n"
+            # Add automatic tags
+            for tag in auto_tags:
+                try:
+                    notes_manager.add_tag(note_id, tag)
+                    parts.append(f"Added tag '{tag}' to note #{note_id}\n")
+                except Exception as e:
+                    parts.append(f"{ZettlFormatter.warning(f'Could not add tag {tag}: {str(e)}')}\n")
 
-                    # Show tags if any
+            # Add user-provided tags
+            for tag in tags:
+                if tag and tag not in auto_tags:
                     try:
-                        tags = notes_manager.get_tags(note_id)
-                        if tags:
-                            result += f"Tags: {', '.join([ZettlFormatter.tag(t) for t in tags])}"
+                        notes_manager.add_tag(note_id, tag)
+                        parts.append(f"Added tag '{tag}' to note #{note_id}\n")
                     except Exception as e:
-                        logger.exception(f"Error getting tags for note {note_id}: {e}")
+                        parts.append(f"{ZettlFormatter.warning(f'Could not add tag {tag}: {str(e)}')}\n")
 
+            # Create links from -l options
+            for link_id in link_ids:
+                try:
+                    notes_manager.create_link(note_id, link_id)
+                    parts.append(f"Created link from #{note_id} to #{link_id}\n")
                 except Exception as e:
-                    logger.exception(f"Error in show command for note {note_id}: {e}")
-
-                    # Provide a helpful error message based on the exception
-                    if "not found" in str(e).lower():
-                        result = ZettlFormatter.error(f"Note {note_id} not found")
-                    elif "connection" in str(e).lower() or "request failed" in str(e).lower():
-                        result = ZettlFormatter.error(f"Database connection error: {str(e)}")
-                    elif "authentication" in str(e).lower() or "401" in str(e):
-                        result = ZettlFormatter.error(f"Authentication error: {str(e)}")
-                    else:
-                        result = ZettlFormatter.error(f"Error retrieving note: {str(e)}")
-
-                
-        elif cmd == "search":
-            # Import re module for pattern matching in search highlighting
-            import re
-
-            # Parse options - handle both single values and lists
-            tags = options.get('tag', [])
-            exclude_tags = options.get('exclude-tag', [])
-
-            # Ensure tags and exclude_tags are always lists
-            if not isinstance(tags, list):
-                tags = [tags] if tags else []
-            if not isinstance(exclude_tags, list):
-                exclude_tags = [exclude_tags] if exclude_tags else []
-
-            full = 'f' in flags or 'full' in flags
-            query = remaining_args[0] if remaining_args else ""
-            search_description = []
-
-            # Step 1: Get initial result set based on primary criteria
-            if query:
-                # Search by content
-                search_results = notes_manager.search_notes(query)
-                if not search_results:
-                    result = ZettlFormatter.warning(f"No notes found containing '{query}'")
-                else:
-                    search_description.append(f"containing '{query}'")
-                    result = ""
-            else:
-                # No primary search criteria - start with all notes
-                # If we have any tag filters, we need to search ALL notes
-                if tags or exclude_tags:
-                    search_results = notes_manager.list_notes(limit=10000)
-                    result = ""
-                else:
-                    # No filters at all - just list recent notes
-                    search_results = notes_manager.list_notes(limit=50)
-                    result = f"{ZettlFormatter.header(f'Listing notes (showing {len(search_results)}):')}\n\n"
-
-            # Step 2: Apply include tag filters (must have ALL specified tags)
-            if tags and 'search_results' in locals():
-                # Get note IDs for each required tag
-                tag_note_sets = []
-                for t in tags:
-                    tag_notes = notes_manager.get_notes_by_tag(t)
-                    tag_note_ids = {note['id'] for note in tag_notes}
-                    tag_note_sets.append(tag_note_ids)
-
-                # Find intersection - notes that have ALL required tags
-                if tag_note_sets:
-                    required_ids = set.intersection(*tag_note_sets) if tag_note_sets else set()
-
-                    # Filter results to only include notes with ALL required tags
-                    original_count = len(search_results)
-                    search_results = [note for note in search_results if note['id'] in required_ids]
-
-                    tags_str = "', '".join(tags)
-                    search_description.append(f"with tags '{tags_str}'")
-
-                    if not search_results and original_count > 0:
-                        result = ZettlFormatter.warning(f"No notes found with all tags: '{tags_str}'")
-
-            # Step 3: Apply exclude tag filters (must not have ANY excluded tags)
-            if exclude_tags and 'search_results' in locals():
-                # Get note IDs for each excluded tag
-                excluded_ids = set()
-                for et in exclude_tags:
-                    excluded_notes = notes_manager.get_notes_by_tag(et)
-                    excluded_ids.update(note['id'] for note in excluded_notes)
-
-                # Filter out notes with ANY excluded tag
-                original_count = len(search_results)
-                search_results = [note for note in search_results if note['id'] not in excluded_ids]
-
-                excluded_tags_str = "', '".join(exclude_tags)
-
-                if original_count != len(search_results):
-                    if not result:
-                        result = ""
-                    result += f"{ZettlFormatter.info(f'Excluded {original_count - len(search_results)} notes with tags: {excluded_tags_str}')}\n\n"
-
-            # Build and display search header
-            if 'search_results' in locals() and search_results:
-                if search_description or tags or exclude_tags:
-                    header_msg = f"Found {len(search_results)} notes"
-                    if search_description:
-                        header_msg += f" {' and '.join(search_description)}"
-                    if not result:
-                        result = ""
-                    result = f"{ZettlFormatter.header(header_msg)}\n\n" + result
-            
-            # Display the results if we have any
-            if 'search_results' in locals() and search_results:
-                for note in search_results:
-                    if full:
-                        # Full content mode
-                        result += f"{ZettlFormatter.note_id(note['id'])}\n"
-                        result += "-" * 40 + "\n"
-                        result += f"{note['content']}\n"
-
-                        # Add tags display
-                        try:
-                            tags = notes_manager.get_tags(note['id'])
-                            if tags:
-                                result += f"Tags: {', '.join([ZettlFormatter.tag(t) for t in tags])}\n"
-                        except Exception:
-                            pass
+                    parts.append(f"{ZettlFormatter.warning(f'Could not create link to #{link_id}: {str(e)}')}\n")
 
-                        result += "\n"  # Extra line between notes
-                    else:
-                        # Preview mode
-                        content_preview = note['content'][:50] + "..." if len(note['content']) > 50 else note['content']
-                        if query:
-                            # Highlight the query in the preview with markdown bold
-                            pattern = re.compile(re.escape(query), re.IGNORECASE)
-                            content_preview = pattern.sub(r"**\g<0>**", content_preview)
-
-                        result += f"{ZettlFormatter.note_id(note['id'])}: {content_preview}\n"
-                    
-        elif cmd == "tags":
-            # Handle various ways the tags command is used
-            # Usage: tags                       - List all tags
-            #        tags note_id               - Show tags for note
-            #        tags note_id "tag1"        - Add single tag
-            #        tags note_id "tag1 tag2..." - Add multiple tags
-            #        tags note_id "tag1" -r     - Remove tag(s)
-            remove_mode = 'r' in flags or 'remove' in flags
-
-            if not remaining_args:
-                # List all tags
-                tags_with_counts = notes_manager.get_all_tags_with_counts()
-                if tags_with_counts:
-                    result = f"{ZettlFormatter.header(f'All Tags (showing {len(tags_with_counts)})')}\n\n"
-                    for tag_info in tags_with_counts:
-                        formatted_tag = ZettlFormatter.tag(tag_info['tag'])
-                        result += f"{formatted_tag} ({tag_info['count']} notes)\n"
-                else:
-                    result = ZettlFormatter.warning("No tags found.")
-            else:
-                note_id = remaining_args[0]
-
-                # Handle both formats:
-                # 1. Multiple separate arguments: tags note_id tag1 tag2 tag3
-                # 2. Single quoted string: tags note_id "tag1 tag2 tag3"
-                if len(remaining_args) > 2:
-                    # Multiple separate arguments
-                    tag_list = remaining_args[1:]
-                elif len(remaining_args) == 2:
-                    # Could be single tag or space-separated tags in quotes
-                    tag_string = remaining_args[1]
-                    tag_list = tag_string.split() if ' ' in tag_string else [tag_string]
-                else:
-                    tag_list = []
-
-                # If tags were provided, add or remove them
-                if tag_list:
-                    if remove_mode:
-                        for tag in tag_list:
-                            notes_manager.delete_tag(note_id, tag)
-                        if len(tag_list) == 1:
-                            result = ZettlFormatter.success(f"Removed tag '{tag_list[0]}' from note #{note_id}") + "\n"
-                        else:
-                            result = ZettlFormatter.success(f"Removed {len(tag_list)} tags from note #{note_id}") + "\n"
-                    else:
-                        if len(tag_list) == 1:
-                            notes_manager.add_tag(note_id, tag_list[0])
-                            result = f"Added tag '{tag_list[0]}' to note #{note_id}\n"
-                        else:
-                            notes_manager.add_tags_batch(note_id, tag_list)
-                            result = f"Added {len(tag_list)} tags to note #{note_id}: {', '.join(tag_list)}\n"
-                else:
-                    result = ""
+            result = "".join(parts)
+
+    return result
 
-                # Show all tags for the note
+
+def _cmd_show(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the show command: display a single note."""
+    if not remaining_args:
+        result = ZettlFormatter.error("Please provide a note ID")
+    else:
+        note_id = remaining_args[0]
+
+        try:
+            # Get the note using the standard method
+            note = notes_manager.get_note(note_id)
+            created_at = notes_manager.db.format_timestamp(note['created_at'])
+
+            # Format header
+            parts = [
+                f"{_fmt_note_id(note_id)} [{_fmt_timestamp(created_at)}]\n",
+                _SEP,
+                # Add content
+                f"{note['content']}\n\n",
+            ]
+
+            # Show tags if any
+            try:
                 tags = notes_manager.get_tags(note_id)
                 if tags:
-                    result += f"Tags for note #{note_id}: {', '.join([ZettlFormatter.tag(t) for t in tags])}"
-                else:
-                    result += f"No tags for note #{note_id}"
-                
-        elif cmd == "link":
-            # Create or remove a link between notes
-            if len(remaining_args) >= 2:
-                source_id = remaining_args[0]
-                target_id = remaining_args[1]
-                remove_mode = 'r' in flags or 'remove' in flags
-
-                if remove_mode:
-                    notes_manager.delete_link(source_id, target_id)
-                    result = ZettlFormatter.success(f"Removed link from note #{source_id} to note #{target_id}")
-                else:
-                    context = options.get('context', options.get('c', ''))
-                    notes_manager.create_link(source_id, target_id, context)
-                    result = f"Created link from #{source_id} to #{target_id}"
-            else:
-                result = ZettlFormatter.error("Please provide source and target note IDs")
-                
-        elif cmd == "related":
-            # Show related notes
-            note_id = remaining_args[0] if remaining_args else ""
-            full = 'f' in flags or 'full' in flags
-            
-            if not note_id:
-                result = ZettlFormatter.error("Please provide a note ID")
-            else:
-                # First, show the source note
-                try:
-                    source_note = notes_manager.get_note(note_id)
-                    result = f"{ZettlFormatter.header('Source Note')}\n"
-                    created_at = notes_manager.db.format_timestamp(source_note['created_at'])
-                    result += f"{ZettlFormatter.note_id(note_id)} [{ZettlFormatter.timestamp(created_at)}]\n"
-                    result += "-" * 40 + "\n"
-                    result += f"{source_note['content']}\n\n"
-                except Exception as e:
-                    result = f"{ZettlFormatter.warning(f'Could not display source note: {str(e)}')}\n"
+                    parts.append(f"Tags: {', '.join(map(_fmt_tag, tags))}")
+            except Exception as e:
+                logger.exception(f"Error getting tags for note {note_id}: {e}")
 
-                # Now show related notes
-                related_notes = notes_manager.get_related_notes(note_id)
-                if not related_notes:
-                    result += ZettlFormatter.warning(f"No notes connected to note #{note_id}")
-                else:
-                    result += f"{ZettlFormatter.header(f'Connected Notes ({len(related_notes)} total)')}\n\n"
-
-                    for note in related_notes:
-                        if full:
-                            # Full content mode
-                            note_created_at = notes_manager.db.format_timestamp(note['created_at'])
-                            result += f"{ZettlFormatter.note_id(note['id'])} [{ZettlFormatter.timestamp(note_created_at)}]\n"
-                            result += "-" * 40 + "\n"
-                            result += f"{note['content']}\n\n"
-                        else:
-                            # Preview mode
-                            content_preview = note['content'][:50] + "..." if len(note['content']) > 50 else note['content']
-                            result += f"{ZettlFormatter.note_id(note['id'])}: {content_preview}\n"
-                
-        elif cmd == "graph":
-            # Generate graph - not fully implemented in web version
-            note_id = remaining_args[0] if remaining_args else None
-            output = options.get('output', options.get('o', 'zettl_graph.json'))
-            result = f"Graph feature not fully implemented in web version.\n"
-            result += f"On CLI, this would generate a graph visualization of notes and save to {output}"
-            
-        elif cmd == "llm":
-            # LLM commands
-            if not remaining_args:
-                result = ZettlFormatter.error("Please provide a note ID")
+            result = "".join(parts)
+
+        except Exception as e:
+            logger.exception(f"Error in show command for note {note_id}: {e}")
+
+            # Provide a helpful error message based on the exception
+            if "not found" in str(e).lower():
+                result = ZettlFormatter.error(f"Note {note_id} not found")
+            elif "connection" in str(e).lower() or "request failed" in str(e).lower():
+                result = ZettlFormatter.error(f"Database connection error: {str(e)}")
+            elif "authentication" in str(e).lower() or "401" in str(e):
+                result = ZettlFormatter.error(f"Authentication error: {str(e)}")
             else:
-                note_id = remaining_args[0]
-                action = options.get('action', options.get('a', 'summarize'))
-                count = int(options.get('count', options.get('c', '3')))
-                debug = 'd' in flags or 'debug' in flags
-                
-                # Debug mode - show environment and configuration info
-                if debug:
-                    debug_info = f"{ZettlFormatter.header('LLM Debug Info')}\n\n"
-                    debug_info += f"Note ID: {note_id}\n"
-                    debug_info += f"Action: {action}\n"
-                    debug_info += f"Count: {count}\n"
-                    debug_info += f"LLM Helper Type: {type(llm_helper).__name__}\n"
-                    debug_info += f"Claude API Key Set: {bool(llm_helper.api_key)}\n"
-                    debug_info += f"Model: {getattr(llm_helper, 'model', 'unknown')}\n"
-                    
-                    try:
-                        # Verify note exists
-                        note = notes_manager.get_note(note_id)
-                        debug_info += f"Note exists: Yes\n"
-                        debug_info += f"Note content length: {len(note['content'])}\n"
-                    except Exception as e:
-                        debug_info += f"Note exists: No (Error: {str(e)})\n"
-                        
-                    try:
-                        # Test anthropic import
-                        import anthropic
-                        debug_info += f"Anthropic package: Installed (version: {getattr(anthropic, '__version__', 'unknown')})\n"
-                    except ImportError:
-                        debug_info += "Anthropic package: Not installed\n"
-                        
-                    result = debug_info
-                    return jsonify({'result': process_for_web(result)})
-                    
-                try:
-                    # Check if the note exists first
-                    note = notes_manager.get_note(note_id)
-                    
-                    # Add a processing message to warn the user this might take time
-                    processing_message = f"Processing LLM {action} request for note #{note_id}. This may take a moment..."
-                    result = f"{ZettlFormatter.warning(processing_message)}\n\n"
-                    
-                    if action == "summarize":
-                        summary = llm_helper.summarize_note(note_id)
-                        result += f"{ZettlFormatter.header(f'AI Summary for Note #{note_id}')}\n\n{summary}"
-
-                    elif action == "tags":
-                        tags = llm_helper.suggest_tags(note_id, count)
-                        result += f"{ZettlFormatter.header(f'AI-Suggested Tags for Note #{note_id}')}\n\n"
-                        for tag in tags:
-                            result += f"{ZettlFormatter.tag(tag)}\n"
-
-                    elif action == "connect":
-                        connections = llm_helper.generate_connections(note_id, count)
-                        result += f"{ZettlFormatter.header(f'AI-Suggested Connections for Note #{note_id}')}\n\n"
-                        if not connections:
-                            result += ZettlFormatter.warning("No potential connections found.")
-                        else:
-                            for conn in connections:
-                                conn_id = conn['note_id']
-                                result += f"**Note #{conn_id}**\n\n{conn['explanation']}\n\n"
-
-                    elif action == "expand":
-                        expanded_content = llm_helper.expand_note(note_id)
-                        result += f"{ZettlFormatter.header(f'AI-Expanded Version of Note #{note_id}')}\n\n{expanded_content}"
-
-                    elif action == "concepts":
-                        concepts = llm_helper.extract_key_concepts(note_id, count)
-                        result += f"{ZettlFormatter.header(f'Key Concepts from Note #{note_id}')}\n\n"
-                        if not concepts:
-                            result += ZettlFormatter.warning("No key concepts identified.")
-                        else:
-                            for i, concept in enumerate(concepts, 1):
-                                result += f"{i}. **{concept['concept']}**\n\n   {concept['explanation']}\n\n"
-
-                    elif action == "questions":
-                        questions = llm_helper.generate_question_note(note_id, count)
-                        result += f"{ZettlFormatter.header(f'Thought-Provoking Questions from Note #{note_id}')}\n\n"
-                        if not questions:
-                            result += ZettlFormatter.warning("No questions generated.")
-                        else:
-                            for i, question in enumerate(questions, 1):
-                                result += f"{i}. **{question['question']}**\n\n   {question['explanation']}\n\n"
-
-                    elif action == "critique":
-                        critique = llm_helper.critique_note(note_id)
-                        result += f"{ZettlFormatter.header(f'AI Critique of Note #{note_id}')}\n\n"
-
-                        # Display strengths
-                        if critique['strengths']:
-                            result += "## Strengths\n\n"
-                            for strength in critique['strengths']:
-                                result += f"- {strength}\n"
-                            result += "\n"
-
-                        # Display weaknesses
-                        if critique['weaknesses']:
-                            result += "## Areas for Improvement\n\n"
-                            for weakness in critique['weaknesses']:
-                                result += f"- {weakness}\n"
-                            result += "\n"
-
-                        # Display suggestions
-                        if critique['suggestions']:
-                            result += "## Suggestions\n\n"
-                            for suggestion in critique['suggestions']:
-                                result += f"- {suggestion}\n"
-
-                        # If no structured feedback was generated
-                        if not (critique['strengths'] or critique['weaknesses'] or critique['suggestions']):
-                            result += ZettlFormatter.warning("Could not generate structured feedback for this note.")
-                    else:
-                        result = ZettlFormatter.warning(f"Unknown LLM action: '{action}'. Available actions: summarize, connect, tags, expand, concepts, questions, critique")
-                        
-                except Exception as e:
-                    # Enhanced error handling with specific messages
-                    error_msg = str(e)
-                    logger.exception(f"Error in LLM command: {error_msg}")
-                    
-                    if "authentication" in error_msg.lower() or "auth" in error_msg.lower() or "api key" in error_msg.lower():
-                        result = ZettlFormatter.error(f"Authentication error: {error_msg}. Check your Claude API key in the .env file.")
-                        
-                    elif "note" in error_msg.lower() and "not found" in error_msg.lower():
-                        result = ZettlFormatter.error(f"Note #{note_id} not found.")
-                        
-                    elif "import" in error_msg.lower() and "anthropic" in error_msg.lower():
-                        result = ZettlFormatter.error("The anthropic package is not installed. Install it with: pip install anthropic")
-                        
-                    elif "connection" in error_msg.lower() or "timeout" in error_msg.lower():
-                        result = ZettlFormatter.error(f"Connection error: {error_msg}. Check your network connection.")
-                        
-                    else:
-                        result = ZettlFormatter.error(f"Error processing LLM command: {error_msg}")
-                
-        elif cmd == "delete":
-            # Delete a note
-            if not remaining_args:
-                result = ZettlFormatter.error("Please provide a note ID to delete")
+                result = ZettlFormatter.error(f"Error retrieving note: {str(e)}")
+
+    return result
+
+
+def _cmd_search(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the search command: find notes by content and/or tags."""
+    result = ""
+
+    # Parse options - handle both single values and lists
+    tags = options.get('tag', [])
+    exclude_tags = options.get('exclude-tag', [])
+
+    # Ensure tags and exclude_tags are always lists
+    if not isinstance(tags, list):
+        tags = [tags] if tags else []
+    if not isinstance(exclude_tags, list):
+        exclude_tags = [exclude_tags] if exclude_tags else []
+
+    full = 'f' in flags or 'full' in flags
+    query = _first_arg(remaining_args)
+    search_description = []
+
+    # Step 1: Get initial result set based on primary criteria
+    if query:
+        # Search by content
+        search_results = notes_manager.search_notes(query)
+        if not search_results:
+            result = ZettlFormatter.warning(f"No notes found containing '{query}'")
+        else:
+            search_description.append(f"containing '{query}'")
+            result = ""
+    else:
+        # No primary search criteria - start with all notes
+        # If we have any tag filters, we need to search ALL notes
+        if tags or exclude_tags:
+            search_results = notes_manager.list_notes(limit=10000)
+            result = ""
+        else:
+            # No filters at all - just list recent notes
+            search_results = notes_manager.list_notes(limit=50)
+            result = f"{ZettlFormatter.header(f'Listing notes (showing {len(search_results)}):')}\n\n"
+
+    # Step 2: Apply include tag filters (must have ALL specified tags)
+    if tags and 'search_results' in locals():
+        # Get note IDs for each required tag
+        tag_note_sets = []
+        for t in tags:
+            tag_notes = notes_manager.get_notes_by_tag(t)
+            tag_note_ids = {note['id'] for note in tag_notes}
+            tag_note_sets.append(tag_note_ids)
+
+        # Find intersection - notes that have ALL required tags
+        if tag_note_sets:
+            required_ids = set.intersection(*tag_note_sets) if tag_note_sets else set()
+
+            # Filter results to only include notes with ALL required tags
+            original_count = len(search_results)
+            search_results = [note for note in search_results if note['id'] in required_ids]
+
+            tags_str = "', '".join(tags)
+            search_description.append(f"with tags '{tags_str}'")
+
+            if not search_results and original_count > 0:
+                result = ZettlFormatter.warning(f"No notes found with all tags: '{tags_str}'")
+
+    # Step 3: Apply exclude tag filters (must not have ANY excluded tags)
+    if exclude_tags and 'search_results' in locals():
+        # Get note IDs for each excluded tag
+        excluded_ids = set()
+        for et in exclude_tags:
+            excluded_notes = notes_manager.get_notes_by_tag(et)
+            excluded_ids.update(note['id'] for note in excluded_notes)
+
+        # Filter out notes with ANY excluded tag
+        original_count = len(search_results)
+        search_results = [note for note in search_results if note['id'] not in excluded_ids]
+
+        excluded_tags_str = "', '".join(exclude_tags)
+
+        if original_count != len(search_results):
+            if not result:
+                result = ""
+            result += f"{ZettlFormatter.info(f'Excluded {original_count - len(search_results)} notes with tags: {excluded_tags_str}')}\n\n"
+
+    # Build and display search header
+    if 'search_results' in locals() and search_results:
+        if search_description or tags or exclude_tags:
+            header_msg = f"Found {len(search_results)} notes"
+            if search_description:
+                header_msg += f" {' and '.join(search_description)}"
+            if not result:
+                result = ""
+            result = f"{ZettlFormatter.header(header_msg)}\n\n" + result
+
+    # Display the results if we have any
+    if 'search_results' in locals() and search_results:
+        # Prefetch tags for all results in one request instead of one per note
+        tags_map = {}
+        if full:
+            tags_map = _prefetch_tags(notes_manager, [note['id'] for note in search_results])
+
+        pattern = _highlight_re(query) if query else None
+
+        parts = [result]
+        for note in search_results:
+            if full:
+                # Full content mode
+                parts.append(f"{_fmt_note_id(note['id'])}\n")
+                parts.append(_SEP)
+                parts.append(f"{note['content']}\n")
+
+                # Add tags display
+                note_tags = tags_map.get(note['id'], [])
+                if note_tags:
+                    parts.append(f"Tags: {', '.join(map(_fmt_tag, note_tags))}\n")
+
+                parts.append("\n")  # Extra line between notes
             else:
-                note_id = remaining_args[0]
-                keep_links = 'keep-links' in flags
-                keep_tags = 'keep-tags' in flags
-                
-                # Determine cascade setting based on flags
-                cascade = not (keep_links and keep_tags)
-                
-                # Get the note to show what will be deleted
-                try:
-                    note = notes_manager.get_note(note_id)
-                    content_preview = note['content'][:50] + "..." if len(note['content']) > 50 else note['content']
-                    result = f"Deleting note #{note_id}: {content_preview}\n"
-                except Exception as e:
-                    result = f"{ZettlFormatter.warning(f'Note not found: {str(e)}')}\n"
-                    return jsonify({'result': process_for_web(result)})
-                
-                # Delete the note
-                notes_manager.delete_note(note_id, cascade=cascade)
-                result += ZettlFormatter.success(f"Deleted note #{note_id}")
-                
-
-        elif cmd == "append":
-            # Append text to the end of a note
-            if len(remaining_args) < 2:
-                result = ZettlFormatter.error("Please provide note ID and text to append")
+                # Preview mode
+                content_preview = _preview(note['content'])
+                if pattern:
+                    # Highlight the query in the preview with markdown bold
+                    content_preview = pattern.sub(r"**\g<0>**", content_preview)
+
+                parts.append(f"{_fmt_note_id(note['id'])}: {content_preview}\n")
+
+        result = "".join(parts)
+
+    return result
+
+
+def _cmd_tags(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the tags command: list all tags, or show/add/remove tags on a note."""
+    # Handle various ways the tags command is used
+    # Usage: tags                       - List all tags
+    #        tags note_id               - Show tags for note
+    #        tags note_id "tag1"        - Add single tag
+    #        tags note_id "tag1 tag2..." - Add multiple tags
+    #        tags note_id "tag1" -r     - Remove tag(s)
+    remove_mode = 'r' in flags or 'remove' in flags
+
+    if not remaining_args:
+        # List all tags
+        tags_with_counts = notes_manager.get_all_tags_with_counts()
+        if tags_with_counts:
+            parts = [f"{ZettlFormatter.header(f'All Tags (showing {len(tags_with_counts)})')}\n\n"]
+            for tag_info in tags_with_counts:
+                formatted_tag = _fmt_tag(tag_info['tag'])
+                parts.append(f"{formatted_tag} ({tag_info['count']} notes)\n")
+            result = "".join(parts)
+        else:
+            result = ZettlFormatter.warning("No tags found.")
+    else:
+        note_id = remaining_args[0]
+
+        # Handle both formats:
+        # 1. Multiple separate arguments: tags note_id tag1 tag2 tag3
+        # 2. Single quoted string: tags note_id "tag1 tag2 tag3"
+        if len(remaining_args) > 2:
+            # Multiple separate arguments
+            tag_list = remaining_args[1:]
+        elif len(remaining_args) == 2:
+            # Could be single tag or space-separated tags in quotes
+            tag_string = remaining_args[1]
+            tag_list = tag_string.split() if ' ' in tag_string else [tag_string]
+        else:
+            tag_list = []
+
+        # If tags were provided, add or remove them
+        if tag_list:
+            if remove_mode:
+                for tag in tag_list:
+                    notes_manager.delete_tag(note_id, tag)
+                if len(tag_list) == 1:
+                    result = ZettlFormatter.success(f"Removed tag '{tag_list[0]}' from note #{note_id}") + "\n"
+                else:
+                    result = ZettlFormatter.success(f"Removed {len(tag_list)} tags from note #{note_id}") + "\n"
             else:
-                note_id = remaining_args[0]
-                text = remaining_args[1]
+                if len(tag_list) == 1:
+                    notes_manager.add_tag(note_id, tag_list[0])
+                    result = f"Added tag '{tag_list[0]}' to note #{note_id}\n"
+                else:
+                    notes_manager.add_tags_batch(note_id, tag_list)
+                    result = f"Added {len(tag_list)} tags to note #{note_id}: {', '.join(tag_list)}\n"
+        else:
+            result = ""
 
-                try:
-                    notes_manager.append_to_note(note_id, text)
-                    result = ZettlFormatter.success(f"Appended text to note #{note_id}")
-                except Exception as e:
-                    result = ZettlFormatter.error(f"Error appending to note: {str(e)}")
+        # Show all tags for the note
+        tags = notes_manager.get_tags(note_id)
+        if tags:
+            result += f"Tags for note #{note_id}: {', '.join(map(_fmt_tag, tags))}"
+        else:
+            result += f"No tags for note #{note_id}"
 
-        elif cmd == "prepend":
-            # Prepend text to the beginning of a note
-            if len(remaining_args) < 2:
-                result = ZettlFormatter.error("Please provide note ID and text to prepend")
-            else:
-                note_id = remaining_args[0]
-                text = remaining_args[1]
+    return result
 
-                try:
-                    notes_manager.prepend_to_note(note_id, text)
-                    result = ZettlFormatter.success(f"Prepended text to note #{note_id}")
-                except Exception as e:
-                    result = ZettlFormatter.error(f"Error prepending to note: {str(e)}")
 
-        elif cmd == "edit":
-            # Edit command - return a special response for the web app to handle
-            if not remaining_args:
-                result = ZettlFormatter.error("Please provide a note ID")
+def _cmd_link(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the link command: create or remove a link between notes."""
+    # Create or remove a link between notes
+    if len(remaining_args) >= 2:
+        source_id = remaining_args[0]
+        target_id = remaining_args[1]
+        remove_mode = 'r' in flags or 'remove' in flags
+
+        if remove_mode:
+            notes_manager.delete_link(source_id, target_id)
+            result = ZettlFormatter.success(f"Removed link from note #{source_id} to note #{target_id}")
+        else:
+            context = options.get('context', '')
+            if context is True:
+                # -c given without a value
+                context = ''
+            notes_manager.create_link(source_id, target_id, context)
+            result = f"Created link from #{source_id} to #{target_id}"
+    else:
+        result = ZettlFormatter.error("Please provide source and target note IDs")
+
+    return result
+
+
+def _cmd_related(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the related command: show a note and the notes linked to it."""
+    # Show related notes
+    note_id = _first_arg(remaining_args)
+    full = 'f' in flags or 'full' in flags
+
+    if not note_id:
+        result = ZettlFormatter.error("Please provide a note ID")
+    else:
+        # First, show the source note
+        try:
+            source_note = notes_manager.get_note(note_id)
+            created_at = notes_manager.db.format_timestamp(source_note['created_at'])
+            parts = [
+                f"{ZettlFormatter.header('Source Note')}\n",
+                f"{_fmt_note_id(note_id)} [{_fmt_timestamp(created_at)}]\n",
+                _SEP,
+                f"{source_note['content']}\n\n",
+            ]
+        except Exception as e:
+            parts = [f"{ZettlFormatter.warning(f'Could not display source note: {str(e)}')}\n"]
+
+        # Now show related notes
+        related_notes = notes_manager.get_related_notes(note_id)
+        if not related_notes:
+            parts.append(ZettlFormatter.warning(f"No notes connected to note #{note_id}"))
+        else:
+            parts.append(f"{ZettlFormatter.header(f'Connected Notes ({len(related_notes)} total)')}\n\n")
+
+            for note in related_notes:
+                if full:
+                    # Full content mode
+                    note_created_at = notes_manager.db.format_timestamp(note['created_at'])
+                    parts.append(f"{_fmt_note_id(note['id'])} [{_fmt_timestamp(note_created_at)}]\n")
+                    parts.append(_SEP)
+                    parts.append(f"{note['content']}\n\n")
+                else:
+                    # Preview mode
+                    content_preview = _preview(note['content'])
+                    parts.append(f"{_fmt_note_id(note['id'])}: {content_preview}\n")
+        result = "".join(parts)
+
+    return result
+
+
+def _cmd_graph(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the graph command (CLI only)."""
+    # Generate graph - not fully implemented in web version
+    output = options.get('output', 'zettl_graph.json')
+    result = f"Graph feature not fully implemented in web version.\n"
+    result += f"On CLI, this would generate a graph visualization of notes and save to {output}"
+
+    return result
+
+
+_LLM_ACTIONS = ('summarize', 'connect', 'tags', 'expand', 'concepts', 'questions', 'critique')
+
+
+def _llm_error_message(error_msg, note_id):
+    """Turn an exception message from an LLM action into a user-facing error."""
+    if "authentication" in error_msg.lower() or "auth" in error_msg.lower() or "api key" in error_msg.lower():
+        return ZettlFormatter.error(f"Authentication error: {error_msg}. Check your Claude API key in the .env file.")
+
+    elif "note" in error_msg.lower() and "not found" in error_msg.lower():
+        return ZettlFormatter.error(f"Note #{note_id} not found.")
+
+    elif "import" in error_msg.lower() and "anthropic" in error_msg.lower():
+        return ZettlFormatter.error("The anthropic package is not installed. Install it with: pip install anthropic")
+
+    elif "connection" in error_msg.lower() or "timeout" in error_msg.lower():
+        return ZettlFormatter.error(f"Connection error: {error_msg}. Check your network connection.")
+
+    else:
+        return ZettlFormatter.error(f"Error processing LLM command: {error_msg}")
+
+
+def _render_llm_action(llm_helper, action, note_id, note, count):
+    """Run an LLM action on a note and return its formatted output."""
+    parts = []
+    if action == "summarize":
+        summary = llm_helper.summarize_note(note_id, note=note)
+        parts.append(f"{ZettlFormatter.header(f'AI Summary for Note #{note_id}')}\n\n{summary}")
+
+    elif action == "tags":
+        tags = llm_helper.suggest_tags(note_id, count, note=note)
+        parts.append(f"{ZettlFormatter.header(f'AI-Suggested Tags for Note #{note_id}')}\n\n")
+        for tag in tags:
+            parts.append(f"{_fmt_tag(tag)}\n")
+
+    elif action == "connect":
+        connections = llm_helper.generate_connections(note_id, count, note=note)
+        parts.append(f"{ZettlFormatter.header(f'AI-Suggested Connections for Note #{note_id}')}\n\n")
+        if not connections:
+            parts.append(ZettlFormatter.warning("No potential connections found."))
+        else:
+            for conn in connections:
+                conn_id = conn['note_id']
+                parts.append(f"**Note #{conn_id}**\n\n{conn['explanation']}\n\n")
+
+    elif action == "expand":
+        expanded_content = llm_helper.expand_note(note_id, note=note)
+        parts.append(f"{ZettlFormatter.header(f'AI-Expanded Version of Note #{note_id}')}\n\n{expanded_content}")
+
+    elif action == "concepts":
+        concepts = llm_helper.extract_key_concepts(note_id, count, note=note)
+        parts.append(f"{ZettlFormatter.header(f'Key Concepts from Note #{note_id}')}\n\n")
+        if not concepts:
+            parts.append(ZettlFormatter.warning("No key concepts identified."))
+        else:
+            for i, concept in enumerate(concepts, 1):
+                parts.append(f"{i}. **{concept['concept']}**\n\n   {concept['explanation']}\n\n")
+
+    elif action == "questions":
+        questions = llm_helper.generate_question_note(note_id, count, note=note)
+        parts.append(f"{ZettlFormatter.header(f'Thought-Provoking Questions from Note #{note_id}')}\n\n")
+        if not questions:
+            parts.append(ZettlFormatter.warning("No questions generated."))
+        else:
+            for i, question in enumerate(questions, 1):
+                parts.append(f"{i}. **{question['question']}**\n\n   {question['explanation']}\n\n")
+
+    elif action == "critique":
+        critique = llm_helper.critique_note(note_id, note=note)
+        parts.append(f"{ZettlFormatter.header(f'AI Critique of Note #{note_id}')}\n\n")
+
+        # Display strengths
+        if critique['strengths']:
+            parts.append("## Strengths\n\n")
+            for strength in critique['strengths']:
+                parts.append(f"- {strength}\n")
+            parts.append("\n")
+
+        # Display weaknesses
+        if critique['weaknesses']:
+            parts.append("## Areas for Improvement\n\n")
+            for weakness in critique['weaknesses']:
+                parts.append(f"- {weakness}\n")
+            parts.append("\n")
+
+        # Display suggestions
+        if critique['suggestions']:
+            parts.append("## Suggestions\n\n")
+            for suggestion in critique['suggestions']:
+                parts.append(f"- {suggestion}\n")
+
+        # If no structured feedback was generated
+        if not (critique['strengths'] or critique['weaknesses'] or critique['suggestions']):
+            parts.append(ZettlFormatter.warning("Could not generate structured feedback for this note."))
+
+    return "".join(parts)
+
+
+def _cmd_llm(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the llm command: run an AI action on a note."""
+    # LLM commands
+    if not remaining_args:
+        result = ZettlFormatter.error("Please provide a note ID")
+    else:
+        note_id = remaining_args[0]
+        action = options.get('action', 'summarize')
+        count = int(options.get('count', 3))
+        debug = 'd' in flags or 'debug' in flags
+
+        # Only the llm command needs the helper and its Claude API key lookup
+        llm_helper = get_llm_helper()
+
+        # Debug mode - show environment and configuration info
+        if debug:
+            debug_info = f"{ZettlFormatter.header('LLM Debug Info')}\n\n"
+            debug_info += f"Note ID: {note_id}\n"
+            debug_info += f"Action: {action}\n"
+            debug_info += f"Count: {count}\n"
+            debug_info += f"LLM Helper Type: {type(llm_helper).__name__}\n"
+            debug_info += f"Claude API Key Set: {bool(llm_helper.api_key)}\n"
+            debug_info += f"Model: {getattr(llm_helper, 'model', 'unknown')}\n"
+
+            try:
+                # Verify note exists
+                note = notes_manager.get_note(note_id)
+                debug_info += f"Note exists: Yes\n"
+                debug_info += f"Note content length: {len(note['content'])}\n"
+            except Exception as e:
+                debug_info += f"Note exists: No (Error: {str(e)})\n"
+
+            try:
+                # Test anthropic import
+                import anthropic
+                debug_info += f"Anthropic package: Installed (version: {getattr(anthropic, '__version__', 'unknown')})\n"
+            except ImportError:
+                debug_info += "Anthropic package: Not installed\n"
+
+            result = debug_info
+            return _json_resp({'result': process_for_web(result)})
+
+        try:
+            # Check if the note exists first
+            note = notes_manager.get_note(note_id)
+        except Exception as e:
+            logger.exception(f"Error in LLM command: {str(e)}")
+            return _llm_error_message(str(e), note_id)
+
+        if action not in _LLM_ACTIONS:
+            return ZettlFormatter.warning(f"Unknown LLM action: '{action}'. Available actions: summarize, connect, tags, expand, concepts, questions, critique")
+
+        # Add a processing message to warn the user this might take time
+        processing_message = f"Processing LLM {action} request for note #{note_id}. This may take a moment..."
+        try:
+            result = f"{ZettlFormatter.warning(processing_message)}\n\n"
+            result += _render_llm_action(llm_helper, action, note_id, note, count)
+        except Exception as e:
+            logger.exception(f"Error in LLM command: {str(e)}")
+            result = _llm_error_message(str(e), note_id)
+
+    return result
+
+
+def _cmd_delete(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the delete command: delete a note."""
+    # Delete a note
+    if not remaining_args:
+        result = ZettlFormatter.error("Please provide a note ID to delete")
+    else:
+        note_id = remaining_args[0]
+        keep_links = 'keep-links' in flags
+        keep_tags = 'keep-tags' in flags
+
+        # Determine cascade setting based on flags
+        cascade = not (keep_links and keep_tags)
+
+        # Get the note to show what will be deleted
+        try:
+            note = notes_manager.get_note(note_id)
+            content_preview = _preview(note['content'])
+            result = f"Deleting note #{note_id}: {content_preview}\n"
+        except Exception as e:
+            result = f"{ZettlFormatter.warning(f'Note not found: {str(e)}')}\n"
+            return _json_resp({'result': process_for_web(result)})
+
+        # Delete the note
+        notes_manager.delete_note(note_id, cascade=cascade, note=note)
+        result += ZettlFormatter.success(f"Deleted note #{note_id}")
+
+    return result
+
+
+def _cmd_append(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the append command: add text to the end of a note."""
+    # Append text to the end of a note
+    if len(remaining_args) < 2:
+        result = ZettlFormatter.error("Please provide note ID and text to append")
+    else:
+        note_id = remaining_args[0]
+        text = remaining_args[1]
+
+        try:
+            notes_manager.append_to_note(note_id, text)
+            result = ZettlFormatter.success(f"Appended text to note #{note_id}")
+        except Exception as e:
+            result = ZettlFormatter.error(f"Error appending to note: {str(e)}")
+
+    return result
+
+
+def _cmd_prepend(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the prepend command: add text to the beginning of a note."""
+    # Prepend text to the beginning of a note
+    if len(remaining_args) < 2:
+        result = ZettlFormatter.error("Please provide note ID and text to prepend")
+    else:
+        note_id = remaining_args[0]
+        text = remaining_args[1]
+
+        try:
+            notes_manager.prepend_to_note(note_id, text)
+            result = ZettlFormatter.success(f"Prepended text to note #{note_id}")
+        except Exception as e:
+            result = ZettlFormatter.error(f"Error prepending to note: {str(e)}")
+
+    return result
+
+
+def _cmd_edit(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the edit command: return a note for editing in the browser."""
+    # Edit command - return a special response for the web app to handle
+    if not remaining_args:
+        result = ZettlFormatter.error("Please provide a note ID")
+    else:
+        note_id = remaining_args[0]
+        try:
+            note = notes_manager.get_note(note_id)
+            # Return a special marker for the frontend to detect and open modal
+            return _json_resp({
+                'result': '',
+                'edit_modal': True,
+                'note_id': note_id,
+                'content': note['content']
+            })
+        except Exception as e:
+            result = ZettlFormatter.error(f"Error loading note: {str(e)}")
+
+    return result
+
+
+def _cmd_merge(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the merge command: preview or merge several notes."""
+    # Merge multiple notes into one
+    if len(remaining_args) < 2:
+        result = ZettlFormatter.error("Must provide at least 2 notes to merge")
+    else:
+        note_ids = remaining_args
+        force = 'f' in flags or 'force' in flags
+
+        # Show preview of notes to be merged
+        parts = [f"{ZettlFormatter.header(f'Notes to merge ({len(note_ids)} total):')}\n\n"]
+
+        # Fetch tags for all notes to merge in one request
+        tags_map = _prefetch_tags(notes_manager, note_ids)
+        all_tags = set().union(*tags_map.values())
+        valid_notes = True
+
+        for note_id in note_ids:
+            try:
+                note = notes_manager.get_note(note_id)
+                content_preview = _preview(note['content'], 100)
+                formatted_id = _fmt_note_id(note_id)
+                parts.append(f"{formatted_id}\n")
+                parts.append(f"  {content_preview}\n")
+
+                # Show tags
+                tags = tags_map.get(note_id, [])
+                if tags:
+                    parts.append(f"  Tags: {', '.join(map(_fmt_tag, tags))}\n")
+
+                parts.append("\n")
+            except Exception as e:
+                result = ZettlFormatter.error(f"Error fetching note {note_id}: {str(e)}")
+                valid_notes = False
+                break
+
+        if valid_notes:
+            # Show what will be preserved
+            if all_tags:
+                parts.append(f"{ZettlFormatter.header('Tags that will be added to merged note:')}\n")
+                parts.append(f"{', '.join(map(_fmt_tag, sorted(all_tags)))}\n\n")
+
+            # In web version, we can't do interactive confirmation easily
+            # So we'll proceed if force is set, otherwise show warning
+            if not force:
+                parts.append(f"{ZettlFormatter.warning('⚠️  This will delete the original notes!')}\n")
+                parts.append(f"{ZettlFormatter.warning('Use --force to proceed with merge')}\n")
+                result = "".join(parts)
             else:
-                note_id = remaining_args[0]
+                # Perform the merge
                 try:
-                    note = notes_manager.get_note(note_id)
-                    # Return a special marker for the frontend to detect and open modal
-                    return jsonify({
-                        'result': '',
-                        'edit_modal': True,
-                        'note_id': note_id,
-                        'content': note['content']
-                    })
+                    merged_note_id = notes_manager.merge_notes(list(note_ids))
+                    result = ZettlFormatter.success(f"Successfully merged {len(note_ids)} notes into #{merged_note_id}")
+                    result += f"\n\nView merged note with: show {merged_note_id}"
                 except Exception as e:
-                    result = ZettlFormatter.error(f"Error loading note: {str(e)}")
+                    result = ZettlFormatter.error(f"Error merging notes: {str(e)}")
 
-        elif cmd == "merge":
-            # Merge multiple notes into one
-            if len(remaining_args) < 2:
-                result = ZettlFormatter.error("Must provide at least 2 notes to merge")
-            else:
-                note_ids = remaining_args
-                force = 'f' in flags or 'force' in flags
+    return result
 
-                # Show preview of notes to be merged
-                result = f"{ZettlFormatter.header(f'Notes to merge ({len(note_ids)} total):')}\n\n"
 
-                all_tags = set()
-                valid_notes = True
+def _iter_rules(content):
+    """
+    Yield the rules in a note: each numbered item (like "1. Rule text") runs to
+    the next one, and a note without numbered items is a single rule.
+    """
+    start = None
+    for match in _RULE_START_RE.finditer(content):
+        if start is not None:
+            yield content[start:match.start()].strip()
+        start = match.start()
+
+    if start is not None:
+        # The last rule runs to the end of the note
+        yield content[start:].strip()
+    else:
+        yield content.strip()
 
-                for note_id in note_ids:
-                    try:
-                        note = notes_manager.get_note(note_id)
-                        content_preview = note['content'][:100] + "..." if len(note['content']) > 100 else note['content']
-                        formatted_id = ZettlFormatter.note_id(note_id)
-                        result += f"{formatted_id}\n"
-                        result += f"  {content_preview}\n"
 
-                        # Show tags
-                        try:
-                            tags = notes_manager.get_tags(note_id)
-                            if tags:
-                                all_tags.update(tags)
-                                result += f"  Tags: {', '.join([ZettlFormatter.tag(t) for t in tags])}\n"
-                        except Exception:
-                            pass
+def _cmd_rules(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the rules command: show a random rule from notes tagged rules."""
+    # Parse the source flag
+    source = 'source' in flags or 's' in flags
 
-                        result += "\n"
-                    except Exception as e:
-                        result = ZettlFormatter.error(f"Error fetching note {note_id}: {str(e)}")
-                        valid_notes = False
-                        break
-
-                if valid_notes:
-                    # Show what will be preserved
-                    if all_tags:
-                        result += f"{ZettlFormatter.header('Tags that will be added to merged note:')}\n"
-                        result += f"{', '.join([ZettlFormatter.tag(t) for t in sorted(all_tags)])}\n\n"
-
-                    # In web version, we can't do interactive confirmation easily
-                    # So we'll proceed if force is set, otherwise show warning
-                    if not force:
-                        result += f"{ZettlFormatter.warning('⚠️  This will delete the original notes!')}\n"
-                        result += f"{ZettlFormatter.warning('Use --force to proceed with merge')}\n"
-                    else:
-                        # Perform the merge
-                        try:
-                            merged_note_id = notes_manager.merge_notes(list(note_ids))
-                            result = ZettlFormatter.success(f"Successfully merged {len(note_ids)} notes into #{merged_note_id}")
-                            result += f"\n\nView merged note with: show {merged_note_id}"
-                        except Exception as e:
-                            result = ZettlFormatter.error(f"Error merging notes: {str(e)}")
+    # Get all notes tagged with 'rules'
+    rules_notes = notes_manager.get_notes_by_tag('rules')
 
-        elif cmd == "rules":
-            # Import re module for pattern matching
-            import re
+    if not rules_notes:
+        result = ZettlFormatter.warning("No notes found with tag 'rules'")
+    else:
+        import random
+
+        # Pick one rule uniformly at random with reservoir sampling, so rules are
+        # parsed lazily and never collected into a list just to choose one
+        random_rule = None
+        seen = 0
+        for note in rules_notes:
+            for full_text in _iter_rules(note['content']):
+                seen += 1
+                if random.randrange(seen) == 0:
+                    random_rule = {'note_id': note['id'], 'full_text': full_text}
+
+        if not seen:
+            result = ZettlFormatter.warning("Couldn't extract any rules from the notes")
+        else:
+            # Display the rule
+            result = f"{ZettlFormatter.header('Random Rule')}\n\n"
 
-            # Parse the source flag
-            source = 'source' in flags or 's' in flags
-            
-            # Get all notes tagged with 'rules'
-            rules_notes = notes_manager.get_notes_by_tag('rules')
-            
-            if not rules_notes:
-                result = ZettlFormatter.warning("No notes found with tag 'rules'")
+            if source:
+                # Show the source note ID
+                result += f"Source: {_fmt_note_id(random_rule['note_id'])}\n\n"
+
+            # Always show the full rule
+            result += random_rule['full_text']
+
+    return result
+
+
+def _cmd_help(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the help command."""
+    result = CommandHelp.get_main_help()
+
+    return result
+
+
+def _cmd_api_key(cmd, options, flags, remaining_args, notes_manager):
+    """Handle the api-key command: generate or list CLI API keys."""
+    # Handle API key operations with flag-based interface
+    generate = 'generate' in options or 'g' in flags
+    list_keys = 'list' in options or 'l' in flags
+
+    if generate:
+        # Generate new API key
+        try:
+            token = session.get('access_token')
+            if not token:
+                result = ZettlFormatter.error("Not authenticated. Please login first.")
             else:
-                # Extract rules from all notes
-                all_rules = []
-                
-                for note in rules_notes:
-                    note_id = note['id']
-                    content = note['content']
-                    
-                    # Try to parse numbered rules (like "1. Rule text")
-                    lines = content.split('\n')
-                    rule_starts = []
-                    
-                    # Find line numbers where rules start
-                    for i, line in enumerate(lines):
-                        if re.match(r'^\s*\d+[\.\)]\s+', line):
-                            rule_starts.append(i)
-                    
-                    if rule_starts:
-                        # This note contains numbered rules
-                        for i, start_idx in enumerate(rule_starts):
-                            # Determine where this rule ends (next rule start or end of note)
-                            end_idx = rule_starts[i+1] if i+1 < len(rule_starts) else len(lines)
-                            
-                            # Extract the rule text
-                            rule_lines = lines[start_idx:end_idx]
-                            full_text = '\n'.join(rule_lines).strip()
-                            
-                            rule = {
-                                'note_id': note_id,
-                                'full_text': full_text
-                            }
-                            all_rules.append(rule)
-                    else:
-                        # This note doesn't have numbered items, treat it as a single rule
-                        rule = {
-                            'note_id': note_id,
-                            'full_text': content.strip()
-                        }
-                        all_rules.append(rule)
-                        
-                if not all_rules:
-                    result = ZettlFormatter.warning("Couldn't extract any rules from the notes")
+                # Get optional key name from remaining args
+                key_name = _first_arg(remaining_args, "Web Interface Key")
+
+                response = requests.post(f'{AUTH_URL}/api/auth/api-key',
+                                       headers={'Authorization': f'Bearer {token}'},
+                                       json={'name': key_name})
+                if response.status_code == 200:
+                    api_key = response.json()['apiKey']
+                    result = "🎉 API Key Generated Successfully!\n\n"
+                    result += f"🔑 Your new API key: {api_key}\n\n"
+                    result += "⚠️  IMPORTANT: Copy this key now! You won't be able to see it again.\n\n"
+                    result += "To use this key with the CLI:\n"
+                    result += "  zettl auth setup\n"
                 else:
-                    # Import random if not already imported
-                    import random
-                    
-                    # Select a random rule
-                    random_rule = random.choice(all_rules)
-                    
-                    # Display the rule
-                    result = f"{ZettlFormatter.header('Random Rule')}\n\n"
-                    
-                    if source:
-                        # Show the source note ID
-                        result += f"Source: {ZettlFormatter.note_id(random_rule['note_id'])}\n\n"
-                    
-                    # Always show the full rule
-                    result += random_rule['full_text']
-
-        elif cmd == "help" or cmd == "--help":
-            result = CommandHelp.get_main_help()
-
-        elif cmd == "api-key" or cmd == "apikey":
-            # Handle API key operations with flag-based interface
-            generate = 'generate' in options or 'g' in flags
-            list_keys = 'list' in options or 'l' in flags
-
-            if generate:
-                # Generate new API key
-                try:
-                    token = session.get('access_token')
-                    if not token:
-                        result = ZettlFormatter.error("Not authenticated. Please login first.")
-                    else:
-                        # Get optional key name from remaining args
-                        key_name = remaining_args[0] if remaining_args else "Web Interface Key"
-
-                        response = requests.post(f'{AUTH_URL}/api/auth/api-key',
-                                               headers={'Authorization': f'Bearer {token}'},
-                                               json={'name': key_name})
-                        if response.status_code == 200:
-                            api_key = response.json()['apiKey']
-                            result = "🎉 API Key Generated Successfully!\n\n"
-                            result += f"🔑 Your new API key: {api_key}\n\n"
-                            result += "⚠️  IMPORTANT: Copy this key now! You won't be able to see it again.\n\n"
-                            result += "To use this key with the CLI:\n"
-                            result += "  zettl auth setup\n"
-                        else:
-                            result = ZettlFormatter.error("Failed to generate API key")
-                except Exception as e:
-                    result = ZettlFormatter.error(f"Error generating API key: {str(e)}")
-            elif list_keys:
-                # List existing API keys
-                try:
-                    token = session.get('access_token')
-                    if not token:
-                        result = ZettlFormatter.error("Not authenticated. Please login first.")
-                    else:
-                        response = requests.get(f'{AUTH_URL}/api/auth/api-keys',
-                                              headers={'Authorization': f'Bearer {token}'})
-                        if response.status_code == 200:
-                            api_keys = response.json()
-                            if api_keys:
-                                result = "🔑 Your API Keys:\n\n"
-                                for key in api_keys:
-                                    created = key.get('created_at', 'Unknown')
-                                    name = key.get('name', 'Unnamed')
-                                    last_used = key.get('last_used', 'Never')
-                                    result += f"• {name}\n"
-                                    result += f"  Created: {created}\n"
-                                    result += f"  Last used: {last_used}\n\n"
-                            else:
-                                result = "No API keys found. Use 'api-key --generate' to create one."
-                        else:
-                            result = ZettlFormatter.error("Failed to list API keys")
-                except Exception as e:
-                    result = ZettlFormatter.error(f"Error listing API keys: {str(e)}")
+                    result = ZettlFormatter.error("Failed to generate API key")
+        except Exception as e:
+            result = ZettlFormatter.error(f"Error generating API key: {str(e)}")
+    elif list_keys:
+        # List existing API keys
+        try:
+            token = session.get('access_token')
+            if not token:
+                result = ZettlFormatter.error("Not authenticated. Please login first.")
             else:
-                result = ZettlFormatter.error("Usage: api-key --list | api-key --generate [name]")
+                response = requests.get(f'{AUTH_URL}/api/auth/api-keys',
+                                      headers={'Authorization': f'Bearer {token}'})
+                if response.status_code == 200:
+                    api_keys = response.json()
+                    if api_keys:
+                        parts = ["🔑 Your API Keys:\n\n"]
+                        for key in api_keys:
+                            created = key.get('created_at', 'Unknown')
+                            name = key.get('name', 'Unnamed')
+                            last_used = key.get('last_used', 'Never')
+                            parts.append(f"• {name}\n")
+                            parts.append(f"  Created: {created}\n")
+                            parts.append(f"  Last used: {last_used}\n\n")
+                        result = "".join(parts)
+                    else:
+                        result = "No API keys found. Use 'api-key --generate' to create one."
+                else:
+                    result = ZettlFormatter.error("Failed to list API keys")
+        except Exception as e:
+            result = ZettlFormatter.error(f"Error listing API keys: {str(e)}")
+    else:
+        result = ZettlFormatter.error("Usage: api-key --list | api-key --generate [name]")
+
+    return result
+
+
+# Command name -> handler, looked up once per request instead of walking an if/elif chain
+_COMMAND_HANDLERS = {
+    'list': _cmd_list,
+    'todo': _cmd_tagged_notes,
+    'idea': _cmd_tagged_notes,
+    'note': _cmd_tagged_notes,
+    'project': _cmd_tagged_notes,
+    'show': _cmd_show,
+    'search': _cmd_search,
+    'tags': _cmd_tags,
+    'link': _cmd_link,
+    'related': _cmd_related,
+    'graph': _cmd_graph,
+    'llm': _cmd_llm,
+    'delete': _cmd_delete,
+    'append': _cmd_append,
+    'prepend': _cmd_prepend,
+    'edit': _cmd_edit,
+    'merge': _cmd_merge,
+    'rules': _cmd_rules,
+    'help': _cmd_help,
+    '--help': _cmd_help,
+    'api-key': _cmd_api_key,
+    'apikey': _cmd_api_key,
+}
 
-        else:
-            result = f"Unknown command: {cmd}. Try 'help' for available commands."
-            
-        logger.debug(f"Command result: {result[:100]}...")
 
-        # Process result for web display
-        result = process_for_web(result)
-        return jsonify({'result': result})
-        
-    except Exception as e:
-        logger.exception(f"Error executing command: {e}")
+# Static Eisenhower matrix layout; quadrant counts and rows are filled in by
+# format_eisenhower_matrix
+_EISENHOWER_TEMPLATE = """<div style='margin-bottom: 20px;'>{title}</div><div style='margin-bottom: 20px;'>Total todos: {total}</div>
+    <div style="overflow-x: auto;">
+      <table style="width: 100%; border-collapse: collapse; margin-bottom: 20px;">
+        <tr>
+          <th style="width: 15%;"></th>
+          <th style="width: 42.5%; color: #ffff00; text-align: center; padding: 10px; border: 1px solid #444;">URGENT</th>
+          <th style="width: 42.5%; color: #ffff00; text-align: center; padding: 10px; border: 1px solid #444;">NOT URGENT</th>
+        </tr>
+        <tr>
+          <th style="text-align: center; padding: 10px; border: 1px solid #444; font-weight: bold;">IMPORTANT</th>
+          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(0, 255, 0, 0.05);">
+            <div style="color: #90ee90; font-weight: bold; margin-bottom: 10px;">DO ({do_count})</div>
+    {do_notes}
+          </td>
+          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(0, 0, 255, 0.05);">
+            <div style="color: #add8e6; font-weight: bold; margin-bottom: 10px;">PLAN ({plan_count})</div>
+    {plan_notes}
+          </td>
+        </tr>
+        <tr>
+          <th style="text-align: center; padding: 10px; border: 1px solid #444; font-weight: bold;">NOT<br>IMPORTANT</th>
+          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(255, 255, 0, 0.05);">
+            <div style="color: #ffff00; font-weight: bold; margin-bottom: 10px;">DELEGATE ({delegate_count})</div>
+    {delegate_notes}
+          </td>
+          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(255, 0, 0, 0.05);">
+            <div style="color: #ff6347; font-weight: bold; margin-bottom: 10px;">DROP ({drop_count})</div>
+    {drop_notes}
+          </td>
+        </tr>
+      </table>
+    </div>
+    """
+
+
+@lru_cache(maxsize=1024)
+def _matrix_note_prefix(note_id):
+    """Opening markup of an Eisenhower matrix row for a note ID."""
+    return f"<div style='margin: 5px 0'>{ZettlFormatter.note_id(note_id)}: "
 
-        # Provide more specific error messages based on the type of error
-        error_str = str(e).lower()
-        if "401" in error_str or "unauthorized" in error_str:
-            error_msg = ZettlFormatter.error("Authentication failed. Please log out and log back in.")
-        elif "connection" in error_str or "timeout" in error_str:
-            error_msg = ZettlFormatter.error("Database connection error. Please try again.")
-        elif "404" in error_str or "not found" in error_str:
-            error_msg = ZettlFormatter.error("Requested resource not found.")
-        else:
-            error_msg = ZettlFormatter.error(f"Command execution failed: {str(e)}")
 
-        return jsonify({'result': process_for_web(error_msg)})
+def _matrix_note_html(note):
+    """Format a single note as an Eisenhower matrix row."""
+    first_line = note['content'].partition('\n')[0]
+    return f"{_matrix_note_prefix(note['id'])}{first_line}</div>"
 
 
-def format_eisenhower_matrix(todo_notes, include_done=False, include_donetoday=False, include_cancel=False, filter_tags=None):
-    """Format todos in an Eisenhower matrix for web display."""
+def format_eisenhower_matrix(notes_manager, todo_notes, include_done=False, include_donetoday=False, include_cancel=False, filter_tags=None, done_today_ids=None):
+    """Format todos in an Eisenhower matrix for web display.
+
+    Pass todo_notes from get_notes_with_all_tags_by_tag so each note already
+    carries its tags in 'all_tags'; tags for any other notes are fetched in one batch.
+    Pass done_today_ids when the caller has already looked them up.
+    """
     # Create four quadrants for Eisenhower categorization
     urgent_important = []      # do - Quadrant 1
     not_urgent_important = []  # pl - Quadrant 2
@@ -2568,40 +2704,30 @@ def format_eisenhower_matrix(todo_notes, include_done=False, include_donetoday=F
     # Track unique note IDs for counting
     unique_ids = set()
     
-    # Get notes with 'done' tag added today
-    done_today_ids = set()
-    if include_donetoday:
-        from datetime import datetime, timedelta, timezone
-        today = datetime.now(timezone.utc).date()
-        
+    # Get notes with 'done' tag added today, unless the caller already did
+    if not include_donetoday:
+        done_today_ids = set()
+    elif done_today_ids is None:
+        done_today_ids = set()
         try:
-            # Get tags created today using the proper PostgREST method
-            done_tags_today = notes_manager.db.get_tags_created_today('done')
-
-            for tag_data in done_tags_today:
-                note_id = tag_data.get('note_id')
-                if note_id:
-                    done_today_ids.add(note_id)
+            # Only the note IDs are selected and streamed into the set
+            done_today_ids.update(notes_manager.db.iter_note_ids_with_tag_today('done'))
         except Exception as e:
             logger.error(f"Could not determine todos completed today: {str(e)}")
     
-    # Filter by tag if specified
-    if filter_tags:
-        filtered_notes = []
-        for note in todo_notes:
-            note_id = note['id']
-            note_tags = [t.lower() for t in notes_manager.get_tags(note_id)]
-            
-            # Check if all filter tags are present
-            if all(f.lower() in note_tags for f in filter_tags):
-                filtered_notes.append(note)
-        todo_notes = filtered_notes
+    # Notes from get_notes_with_all_tags_by_tag carry their tags already;
+    # any others are fetched in one batch rather than per note
+    missing_ids = [note['id'] for note in todo_notes if 'all_tags' not in note]
+    tags_map = _prefetch_tags(notes_manager, missing_ids) if missing_ids else {}
+    filters_lower = frozenset(f.lower() for f in filter_tags) if filter_tags else frozenset()
     
     for note in todo_notes:
         note_id = note['id']
-        # Get all tags for this note
-        note_tags = notes_manager.get_tags(note_id)
-        tags_lower = [t.lower() for t in note_tags]
+        tags_lower = {t.lower() for t in (note['all_tags'] if 'all_tags' in note else tags_map.get(note_id, ()))}
+        
+        # Filter by tag if specified
+        if not filters_lower.issubset(tags_lower):
+            continue
         
         # Check status flags
         is_done = 'done' in tags_lower
@@ -2634,98 +2760,34 @@ def format_eisenhower_matrix(todo_notes, include_done=False, include_donetoday=F
         # Track all displayed todos
         unique_ids.add(note_id)
     
-    # Start building HTML output
-    output = f"<div style='margin-bottom: 20px;'>{ZettlFormatter.header('Eisenhower Matrix')}</div>"
-    output += f"<div style='margin-bottom: 20px;'>Total todos: {len(unique_ids)}</div>"
-    
-    # Helper to format a single note for HTML
-    def format_note_html(note):
-        formatted_id = ZettlFormatter.note_id(note['id'])
-        content_lines = note['content'].split('\n')
-        return f"<div style='margin: 5px 0'>{formatted_id}: {content_lines[0]}</div>"
-    
-    # Store the counts
-    do_count = len(urgent_important)
-    plan_count = len(not_urgent_important)
-    delegate_count = len(urgent_not_important)
-    drop_count = len(not_urgent_not_important)
-    
-    # Create HTML matrix table with explicit count values
-    output += f"""
-    <div style="overflow-x: auto;">
-      <table style="width: 100%; border-collapse: collapse; margin-bottom: 20px;">
-        <tr>
-          <th style="width: 15%;"></th>
-          <th style="width: 42.5%; color: #ffff00; text-align: center; padding: 10px; border: 1px solid #444;">URGENT</th>
-          <th style="width: 42.5%; color: #ffff00; text-align: center; padding: 10px; border: 1px solid #444;">NOT URGENT</th>
-        </tr>
-        <tr>
-          <th style="text-align: center; padding: 10px; border: 1px solid #444; font-weight: bold;">IMPORTANT</th>
-          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(0, 255, 0, 0.05);">
-            <div style="color: #90ee90; font-weight: bold; margin-bottom: 10px;">DO ({do_count})</div>
-    """
-    
-    # Add Q1 todos (Do - Urgent & Important)
-    for note in urgent_important:
-        output += format_note_html(note)
-    
-    output += f"""
-          </td>
-          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(0, 0, 255, 0.05);">
-            <div style="color: #add8e6; font-weight: bold; margin-bottom: 10px;">PLAN ({plan_count})</div>
-    """
-    
-    # Add Q2 todos (Plan - Not Urgent & Important)
-    for note in not_urgent_important:
-        output += format_note_html(note)
-    
-    output += f"""
-          </td>
-        </tr>
-        <tr>
-          <th style="text-align: center; padding: 10px; border: 1px solid #444; font-weight: bold;">NOT<br>IMPORTANT</th>
-          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(255, 255, 0, 0.05);">
-            <div style="color: #ffff00; font-weight: bold; margin-bottom: 10px;">DELEGATE ({delegate_count})</div>
-    """
-    
-    # Add Q3 todos (Delegate - Urgent & Not Important)
-    for note in urgent_not_important:
-        output += format_note_html(note)
-    
-    output += f"""
-          </td>
-          <td style="border: 1px solid #444; padding: 10px; vertical-align: top; background-color: rgba(255, 0, 0, 0.05);">
-            <div style="color: #ff6347; font-weight: bold; margin-bottom: 10px;">DROP ({drop_count})</div>
-    """
-    
-    # Add Q4 todos (Drop - Not Urgent & Not Important)
-    for note in not_urgent_not_important:
-        output += format_note_html(note)
-    
-    output += """
-          </td>
-        </tr>
-      </table>
-    </div>
-    """
+    # Fill the matrix scaffolding with each quadrant's rows in one pass
+    parts = [_EISENHOWER_TEMPLATE.format(
+        title=ZettlFormatter.header('Eisenhower Matrix'),
+        total=len(unique_ids),
+        do_count=len(urgent_important),
+        do_notes="".join(map(_matrix_note_html, urgent_important)),
+        plan_count=len(not_urgent_important),
+        plan_notes="".join(map(_matrix_note_html, not_urgent_important)),
+        delegate_count=len(urgent_not_important),
+        delegate_notes="".join(map(_matrix_note_html, urgent_not_important)),
+        drop_count=len(not_urgent_not_important),
+        drop_notes="".join(map(_matrix_note_html, not_urgent_not_important)),
+    )]
     
     # Display additional categories if requested
     if uncategorized:
-        output += f"<div style='margin: 20px 0 10px 0; padding-top: 20px; border-top: 1px solid #444;'>{ZettlFormatter.warning(f'Uncategorized Todos ({len(uncategorized)})')}:</div>"
-        for note in uncategorized:
-            output += format_note_html(note)
+        parts.append(f"<div style='margin: 20px 0 10px 0; padding-top: 20px; border-top: 1px solid #444;'>{ZettlFormatter.warning(f'Uncategorized Todos ({len(uncategorized)})')}:</div>")
+        parts.extend(map(_matrix_note_html, uncategorized))
 
     if include_done and done_todos:
-        output += f"<div style='margin: 20px 0 10px 0; padding-top: 20px; border-top: 1px solid #444;'>{ZettlFormatter.header(f'Completed Todos ({len(done_todos)})')}:</div>"
-        for note in done_todos:
-            output += format_note_html(note)
+        parts.append(f"<div style='margin: 20px 0 10px 0; padding-top: 20px; border-top: 1px solid #444;'>{ZettlFormatter.header(f'Completed Todos ({len(done_todos)})')}:</div>")
+        parts.extend(map(_matrix_note_html, done_todos))
 
     if include_cancel and canceled_todos:
-        output += f"<div style='margin: 20px 0 10px 0; padding-top: 20px; border-top: 1px solid #444;'>{ZettlFormatter.header(f'Canceled Todos ({len(canceled_todos)})')}:</div>"
-        for note in canceled_todos:
-            output += format_note_html(note)
+        parts.append(f"<div style='margin: 20px 0 10px 0; padding-top: 20px; border-top: 1px solid #444;'>{ZettlFormatter.header(f'Canceled Todos ({len(canceled_todos)})')}:</div>")
+        parts.extend(map(_matrix_note_html, canceled_todos))
     
-    return output
+    return "".join(parts)
 
 
 